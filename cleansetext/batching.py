@@ -0,0 +1,155 @@
+"""
+Micro-batching of single documents submitted concurrently, e.g. by the threads of a WSGI server.
+"""
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+_STOP = object()
+
+class MicroBatcher:
+    """
+    A class to gather documents submitted by concurrent callers into batches run by a background thread.
+
+    A batch is run as soon as it holds `max_batch_size` documents, or `max_wait` seconds after its first document
+    arrived. Larger values raise throughput, smaller values lower latency; `stats` helps tuning them.
+
+    Args:
+        pipeline (Pipeline): The pipeline to run the batches with.
+        max_batch_size (int): The largest number of documents in a batch. Default is 64.
+        max_wait (float): The longest time in seconds a document waits for its batch to fill up. Default is 0.005.
+        max_workers (int): The number of threads `Pipeline.process_batch` uses for each batch. Default is 1.
+
+    Example:
+        batcher = MicroBatcher(pipeline, max_batch_size=32, max_wait=0.002)
+        batcher.process(['@user', 'hi'])   # from any thread
+        >> ['<USER>', 'hi']
+        batcher.close()
+    """
+    def __init__(self, pipeline, max_batch_size=64, max_wait=0.005, max_workers=1):
+        """Initialize the MicroBatcher instance and start its background thread."""
+        self.pipeline = pipeline
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_workers = max_workers
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._batch_sizes = Counter()
+        self._max_queue_depth = 0
+        self._thread = threading.Thread(target=self._run, name="cleansetext-microbatcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text):
+        """
+        Submit a document to be processed in the next batch.
+
+        Args:
+            text (list): A list of words to process.
+
+        Returns:
+            concurrent.futures.Future: A future that resolves to the processed list of words.
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Cannot submit documents to a closed MicroBatcher")
+            self._queue.put((text, future))
+        return future
+
+    def process(self, text, timeout=None):
+        """
+        Process a document as part of a batch, blocking until its result is ready.
+
+        Args:
+            text (list): A list of words to process.
+            timeout (float): The longest time in seconds to wait for the result. Default is no limit.
+
+        Returns:
+            list: The processed list of words.
+        """
+        return self.submit(text).result(timeout)
+
+    def queue_depth(self):
+        """Return the number of documents waiting for a batch."""
+        return self._queue.qsize()
+
+    def stats(self):
+        """
+        Return statistics about the batches run so far.
+
+        Returns:
+            dict: The number of batches and documents, the current and maximum queue depth,
+                and a histogram mapping each batch size to the number of batches of that size.
+        """
+        with self._lock:
+            histogram = dict(sorted(self._batch_sizes.items()))
+            max_queue_depth = self._max_queue_depth
+        return {
+            "batches": sum(histogram.values()),
+            "documents": sum(size * count for size, count in histogram.items()),
+            "queue_depth": self.queue_depth(),
+            "max_queue_depth": max_queue_depth,
+            "batch_size_histogram": histogram,
+        }
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        with self._lock:
+            self._batch_sizes[len(batch)] += 1
+            self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize() + len(batch))
+        batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+        try:
+            results = self.pipeline.process_batch([text for text, _ in batch], max_workers=self.max_workers)
+        except Exception:
+            # Find out which documents failed, so that only their callers get the exception
+            for text, future in batch:
+                try:
+                    future.set_result(self.pipeline.process(text))
+                except Exception as e:
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def close(self, wait=True):
+        """
+        Stop accepting documents. The documents already submitted are still processed.
+
+        Args:
+            wait (bool): If set to True, block until the background thread has processed them. Default is True.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        if wait:
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,55 @@
+import threading
+
+import pytest
+
+from cleansetext.batching import MicroBatcher
+from cleansetext.pipeline import Pipeline
+from cleansetext.steps import *
+
+class FailOn:
+    def __init__(self, word):
+        self.word = word
+
+    def process(self, text):
+        if self.word in text:
+            raise ValueError(f"cannot process {self.word}")
+        return text
+
+    def explain(self):
+        return "Fail on a word"
+
+def test_micro_batcher_concurrent_callers():
+    pipeline = Pipeline([RemoveEmojis(), ReplaceUsernames()])
+    results = {}
+
+    with MicroBatcher(pipeline, max_batch_size=8, max_wait=0.05) as batcher:
+        def call(i):
+            results[i] = batcher.process([f'@user{i}', 'hi', '🎉'])
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(40)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = batcher.stats()
+
+    assert results == {i: ['<USER>', 'hi'] for i in range(40)}
+    assert stats["documents"] == 40
+    assert max(stats["batch_size_histogram"]) <= 8
+    assert stats["batches"] < 40
+    assert stats["queue_depth"] == 0
+
+def test_micro_batcher_isolates_failures():
+    with MicroBatcher(Pipeline([FailOn('bad')]), max_wait=0.05) as batcher:
+        good = batcher.submit(['good'])
+        bad = batcher.submit(['bad'])
+        assert good.result() == ['good']
+        with pytest.raises(ValueError):
+            bad.result()
+
+def test_micro_batcher_close():
+    batcher = MicroBatcher(Pipeline([RemoveEmojis()]), max_wait=1)
+    future = batcher.submit(['hi', '🎉'])
+    batcher.close()
+    assert future.result(timeout=0) == ['hi']
+    with pytest.raises(RuntimeError):
+        batcher.submit(['hi'])
@@ -0,0 +1,245 @@
+"""
+A compact binary format for cleaned corpora, readable through memory maps.
+
+A corpus stored at `path` is made of three files:
+    path.vocab    The vocabulary, one JSON encoded word per line. The id of a word is its line number.
+    path.tokens   The token ids of every document, back to back, as little-endian uint32.
+    path.offsets  The document index as little-endian uint64: 0 followed by the end offset of every document
+                  in `path.tokens`, counted in tokens.
+
+The files are only ever appended to, in the order vocab, tokens, offsets, so a reader always sees
+a consistent corpus, and a writer can reopen an existing corpus to add more documents. Reopening first
+cuts the files back to the last complete document, in case the previous writer crashed mid-write.
+"""
+import json
+import mmap
+import os
+import sys
+from array import array
+
+def _to_little_endian(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def _from_little_endian(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+def _recover(path):
+    """
+    Cut the corpus files back to the last complete document, dropping what a crashed writer left behind.
+
+    Returns:
+        int: The number of tokens of the complete documents.
+    """
+    if os.path.exists(f"{path}.vocab"):
+        with open(f"{path}.vocab", 'r+b') as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+    n_tokens = 0
+    if os.path.exists(f"{path}.offsets"):
+        with open(f"{path}.offsets", 'r+b') as f:
+            size = os.path.getsize(f"{path}.offsets")
+            size -= size % 8
+            f.truncate(size)
+            if size:
+                f.seek(size - 8)
+                n_tokens = _from_little_endian('Q', f.read(8))[0]
+    # Token ids past the last offset belong to a document whose offset was never written
+    if os.path.exists(f"{path}.tokens") and os.path.getsize(f"{path}.tokens") > n_tokens * 4:
+        with open(f"{path}.tokens", 'r+b') as f:
+            f.truncate(n_tokens * 4)
+    return n_tokens
+
+
+class CorpusWriter:
+    """
+    A class to write lists of words to a binary corpus, buffering them in memory.
+
+    Args:
+        path (str): The path prefix of the corpus files. An existing corpus is appended to, after dropping anything
+            written after its last complete document, e.g. by a writer that crashed.
+        buffer_size (int): The number of tokens buffered before the files are written. Default is 65536.
+
+    Example:
+        with CorpusWriter('clean') as writer:
+            writer.write_many(pipeline.process_batch(texts))
+    """
+    def __init__(self, path, buffer_size=65536):
+        """Initialize the CorpusWriter instance and open the corpus files for appending."""
+        self.path = path
+        self.buffer_size = buffer_size
+        self._vocab = {}
+        self._n_tokens = _recover(path)
+        if os.path.exists(f"{path}.vocab"):
+            with open(f"{path}.vocab", encoding='utf-8') as f:
+                for line in f:
+                    self._vocab[json.loads(line)] = len(self._vocab)
+        self._vocab_file = open(f"{path}.vocab", 'a', encoding='utf-8')
+        self._tokens_file = open(f"{path}.tokens", 'ab')
+        self._offsets_file = open(f"{path}.offsets", 'ab')
+        if self._offsets_file.tell() == 0:
+            self._offsets_file.write(_to_little_endian(array('Q', [0])))
+            self._offsets_file.flush()
+        self._new_words = []
+        self._tokens = array('I')
+        self._offsets = array('Q')
+
+    def write(self, tokens):
+        """
+        Append one document to the corpus.
+
+        Args:
+            tokens (list): The list of words of the document.
+        """
+        vocab = self._vocab
+        ids = []
+        for token in tokens:
+            token_id = vocab.get(token)
+            if token_id is None:
+                token_id = vocab[token] = len(vocab)
+                self._new_words.append(token)
+            ids.append(token_id)
+        self._tokens.extend(ids)
+        self._n_tokens += len(ids)
+        self._offsets.append(self._n_tokens)
+        if len(self._tokens) >= self.buffer_size:
+            self.flush()
+
+    def write_many(self, documents):
+        """
+        Append several documents to the corpus.
+
+        Args:
+            documents (iterable): The lists of words of the documents, e.g. the output of `Pipeline.process_batch`.
+        """
+        for tokens in documents:
+            self.write(tokens)
+
+    def flush(self):
+        """Write the buffered documents to the corpus files."""
+        if self._new_words:
+            self._vocab_file.write(''.join(json.dumps(word, ensure_ascii=False) + "\n" for word in self._new_words))
+            self._new_words = []
+        self._vocab_file.flush()
+        self._tokens_file.write(_to_little_endian(self._tokens))
+        self._tokens_file.flush()
+        self._offsets_file.write(_to_little_endian(self._offsets))
+        self._offsets_file.flush()
+        self._tokens = array('I')
+        self._offsets = array('Q')
+
+    def close(self):
+        """Flush the buffered documents and close the corpus files."""
+        self.flush()
+        self._vocab_file.close()
+        self._tokens_file.close()
+        self._offsets_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CorpusReader:
+    """
+    A class to read a binary corpus through memory maps, with random access to every document.
+
+    Args:
+        path (str): The path prefix of the corpus files.
+
+    Example:
+        with CorpusReader('clean') as reader:
+            reader[42]
+            >> ['<USER>', 'I', 'hate', 'you']
+    """
+    def __init__(self, path):
+        """Initialize the CorpusReader instance and map the corpus files into memory."""
+        self.path = path
+        self._maps = []
+        # Read in the reverse order of the writer, so that every offset and token id read is already resolvable
+        self._offsets = self._map(f"{path}.offsets", 'Q')
+        self._token_ids = self._map(f"{path}.tokens", 'I')
+        with open(f"{path}.vocab", encoding='utf-8') as f:
+            self.vocab = [json.loads(line) for line in f]
+        # A writer may be appending, only use the documents whose tokens are already on disk
+        self._n_documents = max(len(self._offsets) - 1, 0)
+        while self._n_documents > 0 and self._offsets[self._n_documents] > len(self._token_ids):
+            self._n_documents -= 1
+
+    def _map(self, file_path, typecode):
+        size = os.path.getsize(file_path)
+        size -= size % array(typecode).itemsize
+        if size == 0:
+            return array(typecode)
+        with open(file_path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        if sys.byteorder == 'big':
+            values = array(typecode, mapped)
+            values.byteswap()
+            mapped.close()
+            return values
+        self._maps.append(mapped)
+        return memoryview(mapped).cast(typecode)
+
+    def __len__(self):
+        return self._n_documents
+
+    def ids(self, index):
+        """
+        Return the token ids of a document without copying them.
+
+        Args:
+            index (int): The index of the document.
+
+        Returns:
+            memoryview: The token ids, valid until the reader is closed. Release it, or let it go out of scope,
+                before closing the reader so that the memory map can be closed right away.
+        """
+        if index < 0:
+            index += self._n_documents
+        if not 0 <= index < self._n_documents:
+            raise IndexError("document index out of range")
+        return self._token_ids[self._offsets[index]:self._offsets[index + 1]]
+
+    def __getitem__(self, index):
+        vocab = self.vocab
+        return [vocab[token_id] for token_id in self.ids(index)]
+
+    def __iter__(self):
+        for index in range(self._n_documents):
+            yield self[index]
+
+    def close(self):
+        """
+        Release the memory maps. Views returned by `ids` must not be used afterwards.
+
+        A map that views returned by `ids` still point into cannot be closed; it is left open
+        and freed by the garbage collector once those views are released.
+        """
+        for values in (self._token_ids, self._offsets):
+            if isinstance(values, memoryview):
+                try:
+                    values.release()
+                except BufferError:
+                    pass
+        for mapped in self._maps:
+            try:
+                mapped.close()
+            except BufferError:
+                pass
+        self._maps = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
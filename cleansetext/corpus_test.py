@@ -0,0 +1,70 @@
+import pytest
+
+from cleansetext.corpus import CorpusReader, CorpusWriter
+from cleansetext.pipeline import Pipeline
+from cleansetext.steps import *
+
+def test_corpus_round_trip(tmp_path):
+    path = str(tmp_path / "clean")
+    documents = [['<USER>', 'hi', 'there'], [], ['hi', 'new\nline', '🎉'], ['there']]
+    with CorpusWriter(path, buffer_size=2) as writer:
+        writer.write_many(documents)
+
+    with CorpusReader(path) as reader:
+        assert len(reader) == 4
+        assert list(reader) == documents
+        assert reader[2] == ['hi', 'new\nline', '🎉']
+        assert reader[-1] == ['there']
+        assert list(reader.ids(0)) == [0, 1, 2]
+        with pytest.raises(IndexError):
+            reader[4]
+
+def test_corpus_append(tmp_path):
+    path = str(tmp_path / "clean")
+    pipeline = Pipeline([RemoveEmojis(), ReplaceUsernames()])
+    with CorpusWriter(path) as writer:
+        writer.write_many(pipeline.process_batch([['@ab', 'x'], ['🎉', 'y']]))
+    with CorpusWriter(path) as writer:
+        writer.write(['x', 'z'])
+
+    with CorpusReader(path) as reader:
+        assert list(reader) == [['<USER>', 'x'], ['y'], ['x', 'z']]
+        assert reader.vocab == ['<USER>', 'x', 'y', 'z']
+
+def test_corpus_reader_ignores_unflushed_documents(tmp_path):
+    path = str(tmp_path / "clean")
+    writer = CorpusWriter(path)
+    writer.write(['a'])
+    with CorpusReader(path) as reader:
+        assert len(reader) == 0
+    writer.flush()
+    with CorpusReader(path) as reader:
+        assert list(reader) == [['a']]
+    writer.close()
+
+def test_corpus_writer_recovers_from_a_crash(tmp_path):
+    path = str(tmp_path / "clean")
+    with CorpusWriter(path) as writer:
+        writer.write(['a', 'b'])
+    # A writer crashed after writing a new word, the token ids of a document and part of its offset
+    with open(f"{path}.vocab", 'a', encoding='utf-8') as f:
+        f.write('"c"\n"d')
+    with open(f"{path}.tokens", 'ab') as f:
+        f.write(bytes(12))
+    with open(f"{path}.offsets", 'ab') as f:
+        f.write(bytes(3))
+
+    with CorpusWriter(path) as writer:
+        writer.write(['b', 'e'])
+    with CorpusReader(path) as reader:
+        assert list(reader) == [['a', 'b'], ['b', 'e']]
+        assert reader.vocab == ['a', 'b', 'c', 'e']
+
+def test_corpus_reader_closes_with_views_alive(tmp_path):
+    path = str(tmp_path / "clean")
+    with CorpusWriter(path) as writer:
+        writer.write(['a', 'b'])
+    reader = CorpusReader(path)
+    ids = reader.ids(0)
+    reader.close()
+    ids.release()
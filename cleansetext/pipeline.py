@@ -1,27 +1,708 @@
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+from cleansetext import steps as steps_module
+from cleansetext.steps import scan_features
+
+# Bump when the layout of fingerprints changes, so that outputs cached by older versions are not reused
+_FINGERPRINT_VERSION = 2
+_library_digest = None
+
+def _library_fingerprint():
+    """Return a digest of the source of the built-in steps, so that cached outputs are invalidated when it changes."""
+    global _library_digest
+    if _library_digest is None:
+        with open(steps_module.__file__, 'rb') as f:
+            _library_digest = hashlib.sha256(f.read()).hexdigest()
+    return _library_digest
+
+def _canonical(value, active=frozenset()):
+    """
+    Turn a value into a structure whose repr is the same in every process, e.g. by sorting sets.
+
+    `active` holds the ids of the values being canonicalized further up, to detect values that contain themselves.
+    """
+    if isinstance(value, (str, bytes, int, float, bool, type(None))):
+        return value
+    if isinstance(value, re.Pattern):
+        return (value.pattern, value.flags)
+    if isinstance(value, (types.BuiltinFunctionType, type)):
+        return f"{getattr(value, '__module__', None)}.{value.__qualname__}"
+    if id(value) in active:
+        raise ValueError(f"Cannot fingerprint {value!r}, it refers to itself, e.g. through the closure of a recursive function.")
+    active = active | {id(value)}
+    if isinstance(value, dict):
+        return sorted((repr(_canonical(key, active)), _canonical(item, active)) for key, item in value.items())
+    if isinstance(value, (set, frozenset)):
+        return sorted(repr(_canonical(item, active)) for item in value)
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item, active) for item in value]
+    if isinstance(value, types.CodeType):
+        return (value.co_code, _canonical(value.co_consts, active), value.co_names)
+    if isinstance(value, types.FunctionType):
+        # Identify functions by their code too, so that two lambdas or two versions of a function differ
+        closure = []
+        for cell in value.__closure__ or ():
+            try:
+                contents = cell.cell_contents
+            except ValueError:
+                # The cell is empty
+                closure.append(None)
+                continue
+            closure.append(_canonical(contents, active))
+        return (f"{value.__module__}.{value.__qualname__}", _canonical(value.__code__, active),
+                _canonical(value.__defaults__, active), _canonical(value.__kwdefaults__, active), closure)
+    if isinstance(value, types.MethodType):
+        return (_canonical(value.__func__, active), _canonical(value.__self__, active))
+    return _describe_step(value, active)
+
+def _class_code(step_class, active):
+    """Return the canonical code of the methods of a class and of its bases, to tell versions of a step apart."""
+    methods = {}
+    for klass in reversed(step_class.__mro__):
+        if klass.__module__ == 'builtins':
+            continue
+        for name, member in vars(klass).items():
+            if isinstance(member, (staticmethod, classmethod)):
+                member = member.__func__
+            if isinstance(member, types.FunctionType):
+                methods[name] = _canonical(member, active)
+    return sorted(methods.items())
+
+def _describe_step(step, active):
+    if hasattr(step, 'fingerprint'):
+        configuration = step.fingerprint()
+    elif hasattr(step, '__dict__'):
+        configuration = {name: value for name, value in vars(step).items() if not name.startswith('_')}
+    else:
+        configuration = repr(step)
+    step_class = type(step)
+    if step_class.__module__ == steps_module.__name__:
+        code = _library_fingerprint()
+    else:
+        code = _class_code(step_class, active)
+    return (f"{step_class.__module__}.{step_class.__qualname__}", code, _canonical(configuration, active))
+
+def step_fingerprint(step):
+    """
+    Return a fingerprint of the class, code and configuration of a step, stable across processes.
+
+    The configuration is the public attributes of the step. Functions among them are identified by their name, code,
+    defaults and closure, but not by the globals they read. Steps can override it by defining a `fingerprint` method.
+    The code is the source of cleansetext for its own steps, and the code of the methods of the class for other steps,
+    so editing a step changes its fingerprint.
+
+    Steps whose configuration refers to itself, e.g. through a recursive closure, raise a ValueError.
+
+    Args:
+        step: A preprocessing step.
+
+    Returns:
+        str: A hexadecimal digest.
+    """
+    description = repr((_FINGERPRINT_VERSION, _describe_step(step, frozenset([id(step)]))))
+    return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+def _has_complete_fingerprint(step):
+    """Return True if the fingerprint of a step is known to cover its whole configuration."""
+    return hasattr(step, 'fingerprint') or type(step).__module__ == 'cleansetext.steps'
+
+def _is_cacheable(step):
+    """Return True if the output of a step can be cached under its fingerprint."""
+    if _has_complete_fingerprint(step):
+        return True
+    # Private attributes are left out of the fingerprint, so steps holding any must describe themselves
+    return hasattr(step, '__dict__') and not any(name.startswith('_') for name in vars(step))
+
+
+def _apply_step(step, text, context, prescan):
+    """Run a single step on the text, skipping it if the prescan shows that it cannot fire."""
+    triggers = getattr(step, 'triggers', None)
+    if prescan and triggers is not None:
+        if context.features is None:
+            context.features = scan_features(text)
+        if triggers.isdisjoint(context.features):
+            return text
+    # The summary is recomputed lazily, and only after a step has actually run on the text
+    context.features = None
+    return step.process(text)
+
+
+def _is_missing(value):
+    """Return True for the values that stand for a missing row: None, NaN, and pandas.NA or NaT if pandas is loaded."""
+    if value is None or (isinstance(value, float) and value != value):
+        return True
+    pandas = sys.modules.get('pandas')
+    return pandas is not None and pandas.api.types.is_scalar(value) and pandas.isna(value) is True
+
+
+class ProcessContext:
+    """
+    Per-call state of a single `Pipeline.process` call.
+
+    Keeping this state out of the pipeline and its steps is what makes a pipeline safe to share between threads.
+
+    Attributes:
+        features (frozenset): The character-class summary of the current text, or None if it has to be recomputed.
+        diffs (list): The [input, output] pair of every step, filled in when diffs are tracked.
+    """
+    def __init__(self):
+        """Initialize an empty ProcessContext."""
+        self.features = None
+        self.diffs = []
+
+
+def _projection(values, population):
+    """Project the total of a population from a sample, with a 95% confidence interval."""
+    n = len(values)
+    if n == 0:
+        return 0.0, (0.0, 0.0)
+    mean = sum(values) / n
+    total = mean * population
+    if n < 2 or n >= population:
+        return total, (total, total)
+    variance = sum((value - mean) ** 2 for value in values) / (n - 1)
+    # Standard error of the mean, with the finite population correction
+    error = math.sqrt(variance / n) * math.sqrt((population - n) / (population - 1))
+    margin = 1.96 * error * population
+    return total, (max(total - margin, 0.0), total + margin)
+
+
+class PipelineEstimate:
+    """
+    The projected cost of running a pipeline over a whole source, as returned by `Pipeline.estimate`.
+
+    Totals are projected from a uniform sample of the documents. Intervals are 95% confidence intervals.
+
+    Attributes:
+        documents (int): The number of documents in the source.
+        sample_size (int): The number of sampled documents.
+        cpu_seconds (float): The projected CPU time of tokenizing and processing every document.
+        cpu_seconds_interval (tuple): The confidence interval of `cpu_seconds`.
+        output_tokens (float): The projected number of words in the output.
+        output_tokens_interval (tuple): The confidence interval of `output_tokens`.
+        output_bytes (float): The projected memory needed to hold every output list of words in Python.
+        output_bytes_interval (tuple): The confidence interval of `output_bytes`.
+        max_document_bytes (int): The memory of the largest output in the sample.
+        steps (list): For every step, a dict with its `explanation`, projected `seconds`, `share` of the
+            processing time and `drop_rate`, the fraction of its input words it removed.
+    """
+    def __init__(self, documents, sample_size, cpu_seconds, output_tokens, output_bytes, max_document_bytes, steps):
+        """Initialize the PipelineEstimate instance with the projections."""
+        self.documents = documents
+        self.sample_size = sample_size
+        self.cpu_seconds, self.cpu_seconds_interval = cpu_seconds
+        self.output_tokens, self.output_tokens_interval = output_tokens
+        self.output_bytes, self.output_bytes_interval = output_bytes
+        self.max_document_bytes = max_document_bytes
+        self.steps = steps
+
+    def explain(self):
+        """
+        Return a string summary of the estimate.
+
+        Returns:
+            str: One line for the totals, then one line for every step.
+        """
+        lines = [
+            f"Documents: {self.documents} | Sampled: {self.sample_size}",
+            f"CPU time: {self.cpu_seconds:.2f}s ({self.cpu_seconds_interval[0]:.2f}s - {self.cpu_seconds_interval[1]:.2f}s)",
+            f"Output tokens: {self.output_tokens:.0f} ({self.output_tokens_interval[0]:.0f} - {self.output_tokens_interval[1]:.0f})",
+            f"Output memory: {self.output_bytes:.0f} bytes ({self.output_bytes_interval[0]:.0f} - {self.output_bytes_interval[1]:.0f})"
+            f" | Largest document: {self.max_document_bytes} bytes",
+        ]
+        for ind, step in enumerate(self.steps):
+            lines.append(f"Step {ind+1}: {step['explanation']} | Time: {step['seconds']:.2f}s ({step['share']:.0%}) | Drop rate: {step['drop_rate']:.1%}")
+        return "\n".join(lines)
+
+
 class Pipeline:
+    """
+    A class to run a list of preprocessing steps over a list of words.
 
-    def __init__(self, list_of_preprocessing_steps, track_diffs=False):
+    `process` only modifies a pipeline through the diffs it records, appended under `_diffs_lock`, and with
+    `optimize` through the warm-up statistics and the step order chosen once the warm-up is over, both updated
+    under `_stats_lock`. One instance can therefore be shared between threads once it has been constructed.
+
+    Args:
+        list_of_preprocessing_steps (list): The steps to run, in order.
+        track_diffs (bool): If set to True, record the input and output of every step for `explain`. Default is False.
+        prescan (bool): If set to True, compute a character-class summary of each document and skip steps whose
+            `triggers` cannot be present. The output is identical either way. Default is True.
+        optimize (bool): If set to True, measure the cost per word and the drop rate of every step over the first
+            `warmup` documents, then reorder each run of adjacent steps that `commutes` so that cheap, selective
+            filters run first. The output is identical to the declared order. Default is False.
+        warmup (int): The number of documents measured before the steps are reordered. Default is 1000.
+        cache_dir (str): If set, `process_batch` stores the output of every step in this directory, keyed by the
+            fingerprints of the batch and of the steps up to that one. Running a batch again only runs the steps after
+            the longest prefix of steps whose output is cached. Steps other than those of cleansetext must either define a
+            `fingerprint` method or keep their whole configuration in public attributes. Default is None.
+
+    Example:
+        pipeline = Pipeline([RemoveEmojis(), ReplaceUsernames()])
+        pipeline.process(['@user', 'hi', '🤔'])
+        >> ['<USER>', 'hi']
+    """
+    def __init__(self, list_of_preprocessing_steps, track_diffs=False, prescan=True, optimize=False, warmup=1000, cache_dir=None):
+        if optimize and cache_dir is not None:
+            raise ValueError("optimize and cache_dir cannot be used together, as reordering steps changes their prefixes.")
+        if cache_dir is not None:
+            for step in list_of_preprocessing_steps:
+                if not _is_cacheable(step):
+                    raise ValueError(f"{type(step).__name__} has private attributes, define a fingerprint method to use it with cache_dir.")
+                # Fail now rather than in process_batch if the step cannot be fingerprinted
+                step_fingerprint(step)
         self.preproc_steps = list_of_preprocessing_steps
         self.track_diffs = track_diffs
+        self.prescan = prescan
+        self.optimize = optimize
+        self.warmup = warmup
+        self.cache_dir = cache_dir
         self.diffs = []
+        self.diff_steps = []
+        self._diffs_lock = threading.Lock()
+        # Seconds, words in and words out of every declared step during the warm-up window
+        self._step_stats = [[0.0, 0, 0] for _ in list_of_preprocessing_steps]
+        self._warmup_seen = 0
+        self._optimized_steps = None
+        self._stats_lock = threading.Lock()
+
+    def ordered_steps(self):
+        """
+        Return the steps in the order they are currently run.
+
+        Returns:
+            list: The declared steps, or their optimized order once the warm-up window is over.
+        """
+        if self._optimized_steps is not None:
+            return self._optimized_steps
+        return self.preproc_steps
+
+    def _record_warmup(self, measurements):
+        """Add the measurements of one document to the warm-up statistics and reorder the steps once it is over."""
+        with self._stats_lock:
+            if self._optimized_steps is not None:
+                return
+            for stats, (seconds, words_in, words_out) in zip(self._step_stats, measurements):
+                stats[0] += seconds
+                stats[1] += words_in
+                stats[2] += words_out
+            self._warmup_seen += 1
+            if self._warmup_seen >= self.warmup:
+                self._optimized_steps = self._reorder_steps()
+
+    def _step_rank(self, index):
+        """Rank a filter by its cost per word over the fraction of words it drops, lower ranks run first."""
+        seconds, words_in, words_out = self._step_stats[index]
+        if words_in == 0 or words_out >= words_in:
+            return float('inf')
+        return (seconds / words_in) / (1 - words_out / words_in)
+
+    def _reorder_steps(self):
+        """Sort every run of adjacent commuting steps by rank, keeping all other steps in place."""
+        ordered = []
+        run = []
+        for index, step in enumerate(self.preproc_steps):
+            if getattr(step, 'commutes', False):
+                run.append(index)
+                continue
+            ordered.extend(sorted(run, key=self._step_rank))
+            run = []
+            ordered.append(index)
+        ordered.extend(sorted(run, key=self._step_rank))
+        return [self.preproc_steps[index] for index in ordered]
+
+    def _apply_step(self, step, text, context):
+        """Run a single step on the text, skipping it if the prescan shows that it cannot fire."""
+        return _apply_step(step, text, context, self.prescan)
 
     def process(self, text):
-        diff_for_curent_process_call = []
-        for step in self.preproc_steps:
-            text_out = step.process(text)
+        """
+        Run every step over a list of words.
+
+        Args:
+            text (list): A list of words to process.
+
+        Returns:
+            list: The processed list of words.
+        """
+        context = ProcessContext()
+        steps = self.ordered_steps()
+        measure = self.optimize and steps is self.preproc_steps
+        measurements = []
+        original = text
+        for step in steps:
+            if measure:
+                start = time.perf_counter()
+            text_out = self._apply_step(step, text, context)
+            if measure:
+                measurements.append((time.perf_counter() - start, len(text), len(text_out)))
             if self.track_diffs:
-                diff_for_curent_process_call.append([text, text_out])
+                context.diffs.append([text, text_out])
             text = text_out
+        if measure:
+            self._record_warmup(measurements)
         if self.track_diffs:
-            self.diffs.append(diff_for_curent_process_call)
+            with self._diffs_lock:
+                self.diffs.append(context.diffs)
+                self.diff_steps.append(steps)
+        # Skipped steps pass the input through, never hand it back so that changing the output cannot change the input
+        if text is original:
+            text = list(text)
         return text
 
+    def process_batch(self, texts, max_workers=None):
+        """
+        Run the pipeline over several lists of words using a pool of threads that share this pipeline.
+
+        If the pipeline has a `cache_dir`, the batch is run one step at a time and the output of every step is cached,
+        diffs are not tracked in that case.
+
+        Args:
+            texts (iterable): The lists of words to process.
+            max_workers (int): The number of threads to use. Default is the `ThreadPoolExecutor` default,
+                and 1 processes the batch in the calling thread.
+
+        Returns:
+            list: The processed lists of words, in the same order as the input.
+        """
+        if self.cache_dir is not None:
+            return self._process_batch_cached(texts, max_workers)
+        if max_workers == 1:
+            return [self.process(text) for text in texts]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(self.process, texts))
+
+    def _cache_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.jsonl")
+
+    def _process_batch_cached(self, texts, max_workers):
+        """Run a batch step by step, resuming from the longest prefix of steps whose output is cached."""
+        texts = [list(text) for text in texts]
+        digest = hashlib.sha256()
+        for text in texts:
+            digest.update(json.dumps(text, ensure_ascii=False).encode('utf-8'))
+            digest.update(b"\n")
+        # keys[i] identifies the output of the first i steps on this batch
+        keys = [digest.hexdigest()]
+        for step in self.preproc_steps:
+            keys.append(hashlib.sha256((keys[-1] + step_fingerprint(step)).encode('utf-8')).hexdigest())
+
+        start = 0
+        for prefix_length in range(len(self.preproc_steps), 0, -1):
+            if os.path.exists(self._cache_path(keys[prefix_length])):
+                with open(self._cache_path(keys[prefix_length]), encoding='utf-8') as f:
+                    texts = [json.loads(line) for line in f]
+                start = prefix_length
+                break
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for index in range(start, len(self.preproc_steps)):
+            step = self.preproc_steps[index]
+            apply_step = lambda text: self._apply_step(step, text, ProcessContext())
+            if max_workers == 1:
+                texts = [apply_step(text) for text in texts]
+            else:
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    texts = list(executor.map(apply_step, texts))
+            path = self._cache_path(keys[index + 1])
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for text in texts:
+                    f.write(json.dumps(text, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, path)
+        return texts
+
+    def _process_values(self, values, tokenize):
+        """Process a chunk of column values, passing missing values through as None."""
+        results = []
+        for value in values:
+            if _is_missing(value):
+                results.append(None)
+                continue
+            if tokenize is None and isinstance(value, str):
+                raise ValueError("The column holds strings, pass a tokenize function to split them into words.")
+            text = tokenize(value) if tokenize is not None else list(value)
+            results.append(self.process(text))
+        return results
+
+    def _map_chunks(self, chunks, tokenize, max_workers):
+        """Process chunks of column values, in parallel threads if max_workers is greater than 1."""
+        if max_workers == 1:
+            return [self._process_values(values, tokenize) for values in chunks]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda values: self._process_values(values, tokenize), chunks))
+
+    def process_series(self, series, tokenize=None, chunk_size=10000, max_workers=1):
+        """
+        Run the pipeline over a pandas Series, chunk by chunk.
+
+        Requires pandas, which can be installed with `pip install cleansetext[pandas]`.
+
+        Args:
+            series (pandas.Series): A column of strings, or of lists of words if `tokenize` is not given.
+                Missing values are None, NaN, pandas.NA or NaT.
+            tokenize (callable): A function splitting a string into a list of words, e.g. `TweetTokenizer().tokenize`. Default is None.
+            chunk_size (int): The number of rows converted and processed at a time. Default is 10000.
+            max_workers (int): The number of threads processing chunks in parallel. Default is 1.
+
+        Returns:
+            pandas.Series: A column of processed lists of words with the same index and name. Missing values stay None.
+        """
+        try:
+            import pandas as pd
+        except ImportError:
+            raise ImportError("process_series requires pandas, install it with `pip install cleansetext[pandas]`")
+
+        chunks = (series.iloc[start:start + chunk_size].tolist() for start in range(0, len(series), chunk_size))
+        results = []
+        for chunk_results in self._map_chunks(chunks, tokenize, max_workers):
+            results.extend(chunk_results)
+        return pd.Series(results, index=series.index, name=series.name, dtype=object)
+
+    def process_arrow_array(self, array, tokenize=None, chunk_size=10000, max_workers=1):
+        """
+        Run the pipeline over a pyarrow Array or ChunkedArray, chunk by chunk.
+
+        The results are written straight into the offsets and values buffers of a `ListArray` of strings.
+        Requires pyarrow, which can be installed with `pip install cleansetext[arrow]`.
+
+        Args:
+            array (pyarrow.Array or pyarrow.ChunkedArray): A column of strings, or of lists of strings if `tokenize` is not given.
+            tokenize (callable): A function splitting a string into a list of words, e.g. `TweetTokenizer().tokenize`. Default is None.
+            chunk_size (int): The number of rows converted and processed at a time. Default is 10000.
+            max_workers (int): The number of threads processing chunks in parallel. Default is 1.
+
+        Returns:
+            pyarrow.Array or pyarrow.ChunkedArray: A `list<string>` column of the same kind and length as the input.
+                Null values stay null.
+        """
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError("process_arrow_array requires pyarrow, install it with `pip install cleansetext[arrow]`")
+
+        pieces = array.chunks if isinstance(array, pa.ChunkedArray) else [array]
+        chunks = (
+            piece.slice(start, chunk_size).to_pylist()
+            for piece in pieces
+            for start in range(0, len(piece), chunk_size)
+        )
+        out_chunks = []
+        for chunk_results in self._map_chunks(chunks, tokenize, max_workers):
+            offsets = [0]
+            values = []
+            for tokens in chunk_results:
+                if tokens is None:
+                    # A null offset marks a null list, the following offset closes the previous one
+                    offsets[-1] = None
+                    offsets.append(len(values))
+                    continue
+                values.extend(tokens)
+                offsets.append(len(values))
+            out_chunks.append(pa.ListArray.from_arrays(pa.array(offsets, pa.int32()), pa.array(values, pa.string())))
+
+        list_type = pa.list_(pa.string())
+        if isinstance(array, pa.ChunkedArray):
+            return pa.chunked_array(out_chunks, type=list_type)
+        if len(out_chunks) == 1:
+            return out_chunks[0]
+        return pa.concat_arrays(out_chunks) if out_chunks else pa.array([], list_type)
+
+    def estimate(self, source, sample_size=1000, tokenize=None, seed=None):
+        """
+        Estimate the cost of running the pipeline over a source before running it.
+
+        The source is read once, keeping a uniform reservoir sample of its documents, then the pipeline is run
+        over the sample with every step timed. Times are the CPU time of the calling thread, so they do not
+        count time spent waiting, e.g. on other processes sharing the machine.
+
+        Args:
+            source (iterable): The documents, each a string or a list of words. It can be a stream.
+            sample_size (int): The number of documents to sample. Default is 1000.
+            tokenize (callable): A function splitting a string into a list of words, e.g. `TweetTokenizer().tokenize`.
+                Required if the documents are strings. Default is None.
+            seed (int): The seed of the sampling, for repeatable estimates. Default is None.
+
+        Returns:
+            PipelineEstimate: The projected CPU time, output size, memory and per-step costs.
+        """
+        rng = random.Random(seed)
+        sample = []
+        documents = 0
+        for document in source:
+            if tokenize is None and isinstance(document, str):
+                raise ValueError("The source holds strings, pass a tokenize function to split them into words.")
+            documents += 1
+            if len(sample) < sample_size:
+                sample.append(document)
+            else:
+                index = rng.randrange(documents)
+                if index < sample_size:
+                    sample[index] = document
+
+        steps = self.preproc_steps
+        step_seconds = [0.0] * len(steps)
+        step_words_in = [0] * len(steps)
+        step_words_out = [0] * len(steps)
+        document_seconds = []
+        document_tokens = []
+        document_bytes = []
+        for document in sample:
+            start = time.thread_time()
+            text = tokenize(document) if tokenize is not None else list(document)
+            context = ProcessContext()
+            for index, step in enumerate(steps):
+                step_start = time.thread_time()
+                text_out = _apply_step(step, text, context, self.prescan)
+                step_seconds[index] += time.thread_time() - step_start
+                step_words_in[index] += len(text)
+                step_words_out[index] += len(text_out)
+                text = text_out
+            document_seconds.append(time.thread_time() - start)
+            document_tokens.append(len(text))
+            document_bytes.append(sys.getsizeof(text) + sum(sys.getsizeof(word) for word in text))
+
+        scale = documents / len(sample) if sample else 0
+        total_step_seconds = sum(step_seconds)
+        step_estimates = [
+            {
+                "explanation": step.explain(),
+                "seconds": seconds * scale,
+                "share": seconds / total_step_seconds if total_step_seconds else 0.0,
+                "drop_rate": 1 - words_out / words_in if words_in else 0.0,
+            }
+            for step, seconds, words_in, words_out in zip(steps, step_seconds, step_words_in, step_words_out)
+        ]
+        return PipelineEstimate(
+            documents=documents,
+            sample_size=len(sample),
+            cpu_seconds=_projection(document_seconds, documents),
+            output_tokens=_projection(document_tokens, documents),
+            output_bytes=_projection(document_bytes, documents),
+            max_document_bytes=max(document_bytes, default=0),
+            steps=step_estimates,
+        )
+
     def explain(self, show_diffs=False):
         if show_diffs:
             if not self.track_diffs:
                 raise Exception("You need to set track_diffs=True to use this feature!")
 
-        for ind, diff_step in enumerate(zip(self.diffs[-1], self.preproc_steps)):
+        for ind, diff_step in enumerate(zip(self.diffs[-1], self.diff_steps[-1])):
             diff, step = diff_step
             print(f"Step {ind+1}: {step.explain()}")
-            print(f"Diff: {diff[0]} -> {diff[1]}")
\ No newline at end of file
+            print(f"Diff: {diff[0]} -> {diff[1]}")
+
+
+class _GraphNode:
+    """A step of a PipelineGraph, with the steps that follow it and the branches that end with it."""
+    def __init__(self, step=None, fingerprint=None):
+        self.step = step
+        self.fingerprint = fingerprint
+        self.children = []
+        self.outputs = []
+
+
+class PipelineGraph:
+    """
+    A class to run several variants of a pipeline over the same documents, sharing the steps they have in common.
+
+    The branches are merged into a tree: steps at the same position of several branches are run once when the branches
+    agree on every step up to that one. Steps agree when they are the same object, or when they have the same
+    `step_fingerprint` and are either steps of cleansetext or define a `fingerprint` method. Other steps may keep
+    configuration the fingerprint cannot see, e.g. in private attributes, so they are only shared by identity.
+
+    Args:
+        branches (dict): A mapping of output name to the list of steps of that variant.
+        prescan (bool): If set to True, skip steps whose `triggers` cannot be present, like `Pipeline`. Default is True.
+
+    Example:
+        graph = PipelineGraph({
+            'emojis_as_text': [ReplaceUsernames(), EmojiToText()],
+            'no_emojis': [ReplaceUsernames(), RemoveEmojis()],
+        })
+        graph.process(['@user', 'hi', '🤔'])
+        >> {'emojis_as_text': ['<USER>', 'hi', ':thinking_face:'], 'no_emojis': ['<USER>', 'hi']}
+    """
+    def __init__(self, branches, prescan=True):
+        self.branches = dict(branches)
+        self.prescan = prescan
+        self._root = _GraphNode()
+        for name, steps in self.branches.items():
+            node = self._root
+            for step in steps:
+                fingerprint = step_fingerprint(step) if _has_complete_fingerprint(step) else None
+                for child in node.children:
+                    if child.step is step or (fingerprint is not None and child.fingerprint == fingerprint):
+                        node = child
+                        break
+                else:
+                    child = _GraphNode(step, fingerprint)
+                    node.children.append(child)
+                    node = child
+            node.outputs.append(name)
+
+    def process(self, text):
+        """
+        Run every branch over a list of words.
+
+        Args:
+            text (list): A list of words to process.
+
+        Returns:
+            dict: The processed list of words of every branch, by name.
+        """
+        outputs = {}
+        stack = [(self._root, text, ProcessContext())]
+        while stack:
+            node, text, context = stack.pop()
+            if node.step is not None:
+                text = _apply_step(node.step, text, context, self.prescan)
+            for name in node.outputs:
+                # Branches may end on the same list, give each its own copy
+                outputs[name] = list(text)
+            for child in node.children:
+                child_context = ProcessContext()
+                child_context.features = context.features
+                stack.append((child, text, child_context))
+        return {name: outputs[name] for name in self.branches}
+
+    def process_batch(self, texts, max_workers=None):
+        """
+        Run every branch over several lists of words using a pool of threads.
+
+        Args:
+            texts (iterable): The lists of words to process.
+            max_workers (int): The number of threads to use. Default is the `ThreadPoolExecutor` default,
+                and 1 processes the batch in the calling thread.
+
+        Returns:
+            dict: The processed lists of words of every branch, by name, in the same order as the input.
+        """
+        if max_workers == 1:
+            results = [self.process(text) for text in texts]
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(self.process, texts))
+        return {name: [result[name] for result in results] for name in self.branches}
+
+    def explain(self):
+        """Print the tree of steps, with the branches that end after each step."""
+        stack = [(child, 1) for child in reversed(self._root.children)]
+        for name in self._root.outputs:
+            print(f"Output: {name}")
+        while stack:
+            node, depth = stack.pop()
+            outputs = f" -> {', '.join(node.outputs)}" if node.outputs else ""
+            print(f"{'  ' * (depth - 1)}Step {depth}: {node.step.explain()}{outputs}")
+            stack.extend((child, depth + 1) for child in reversed(node.children))
@@ -1,4 +1,8 @@
-from cleansetext.pipeline import Pipeline
+import time
+
+import pytest
+
+from cleansetext.pipeline import Pipeline, PipelineGraph, step_fingerprint
 from cleansetext.steps import *
 
 from nltk.tokenize import TweetTokenizer
@@ -23,4 +27,294 @@ def test_pipeline() -> None:
 
     assert pipeline.process(text) == ['<USER>', 'I', 'hate', 'you', 'and', 'everything', 'about', 'you', '<URL>']
 
-    pipeline.explain(show_diffs=True)
\ No newline at end of file
+    pipeline.explain(show_diffs=True)
+
+class CountingStep:
+    def __init__(self, step):
+        self.step = step
+        self.triggers = step.triggers
+        self.calls = 0
+
+    def process(self, text):
+        self.calls += 1
+        return self.step.process(text)
+
+    def explain(self):
+        return self.step.explain()
+
+    def fingerprint(self):
+        return step_fingerprint(self.step)
+
+def test_pipeline_prescan_skips_steps() -> None:
+    usernames = CountingStep(ReplaceUsernames())
+    urls = CountingStep(ReplaceURLsandHTMLTags())
+    emojis = CountingStep(RemoveEmojis())
+    pipeline = Pipeline([usernames, urls, emojis])
+
+    assert pipeline.process(['plain', 'ascii', 'text']) == ['plain', 'ascii', 'text']
+    assert (usernames.calls, urls.calls, emojis.calls) == (0, 0, 0)
+
+    assert pipeline.process(['@Mary', 'hi', '🎉']) == ['<USER>', 'hi']
+    assert (usernames.calls, urls.calls, emojis.calls) == (1, 0, 1)
+
+def test_pipeline_never_returns_its_input() -> None:
+    text = ['plain', 'ascii', 'text']
+    pipeline = Pipeline([ReplaceUsernames(), RemoveEmojis()])
+    assert pipeline.process(text) is not text
+    assert pipeline.process_batch([text], max_workers=1)[0] is not text
+    assert Pipeline([]).process(text) is not text
+
+def test_pipeline_prescan_matches_full_run() -> None:
+    tk = TweetTokenizer()
+    steps = [
+        RemoveEmojis(),
+        RemoveAllPunctuations(),
+        RemoveTokensWithOnlyPunctuations(),
+        ReplaceURLsandHTMLTags(),
+        ReplaceUsernames(),
+        RemoveUnicode(unicode_above=127),
+        RemoveWhiteSpaceOrChunksOfWhiteSpace()
+    ]
+    texts = [
+        "@Mary I hate you    and everything about you ...... 🎉🎉 google.com",
+        "plain ascii text without anything special",
+        "fish &amp; chips at café.example.org",
+    ]
+    for text in texts:
+        tokens = tk.tokenize(text)
+        assert Pipeline(steps).process(tokens) == Pipeline(steps, prescan=False).process(tokens)
+
+def test_pipeline_process_batch() -> None:
+    tk = TweetTokenizer()
+    pipeline = Pipeline([
+        RemoveEmojis(),
+        RemoveTokensWithOnlyPunctuations(),
+        ReplaceURLsandHTMLTags(),
+        ReplaceUsernames()
+    ])
+    texts = [tk.tokenize(f"@user{i} visit site{i}.com now 🎉 ...") for i in range(200)]
+
+    expected = [pipeline.process(text) for text in texts]
+    assert pipeline.process_batch(texts, max_workers=4) == expected
+    assert pipeline.process_batch(texts, max_workers=1) == expected
+
+def test_pipeline_shared_between_threads_tracks_every_call() -> None:
+    pipeline = Pipeline([RemoveEmojis(ignored_emojis=['🎉']), ReplaceUsernames()], track_diffs=True)
+    texts = [['@user', '🎉', '🤔']] * 100
+
+    assert pipeline.process_batch(texts, max_workers=8) == [['<USER>', '🎉']] * 100
+    assert len(pipeline.diffs) == 100
+    assert pipeline.preproc_steps[0].ignored_emojis == {'🎉'}
+
+def test_pipeline_process_series() -> None:
+    pd = pytest.importorskip("pandas")
+    tk = TweetTokenizer()
+    pipeline = Pipeline([RemoveEmojis(), ReplaceUsernames()])
+    series = pd.Series(["@Mary hi 🎉", None, "plain text", "@bob"], index=[10, 11, 12, 13], name="text")
+
+    expected = [['<USER>', 'hi'], None, ['plain', 'text'], ['<USER>']]
+    for max_workers in (1, 3):
+        out = pipeline.process_series(series, tokenize=tk.tokenize, chunk_size=3, max_workers=max_workers)
+        assert out.tolist() == expected
+        assert out.index.tolist() == [10, 11, 12, 13]
+        assert out.name == "text"
+
+    tokens = pd.Series([['@Mary', 'hi'], ['🎉']])
+    assert pipeline.process_series(tokens).tolist() == [['<USER>', 'hi'], []]
+
+    strings = pd.Series(["@Mary hi", None, "plain"], dtype="string")
+    assert pipeline.process_series(strings, tokenize=str.split).tolist() == [['<USER>', 'hi'], None, ['plain']]
+    with pytest.raises(ValueError):
+        pipeline.process_series(strings)
+
+def test_pipeline_process_arrow_array() -> None:
+    pa = pytest.importorskip("pyarrow")
+    tk = TweetTokenizer()
+    pipeline = Pipeline([RemoveEmojis(), ReplaceUsernames()])
+    array = pa.array([None, "@Mary hi 🎉", None, None, "plain text", "🎉", None])
+
+    expected = [None, ['<USER>', 'hi'], None, None, ['plain', 'text'], [], None]
+    out = pipeline.process_arrow_array(array, tokenize=tk.tokenize, chunk_size=3, max_workers=2)
+    assert isinstance(out, pa.Array)
+    assert out.type == pa.list_(pa.string())
+    assert out.to_pylist() == expected
+
+    chunked = pa.chunked_array([[['@Mary', 'hi']], [None, ['🎉', 'x']]])
+    out = pipeline.process_arrow_array(chunked)
+    assert isinstance(out, pa.ChunkedArray)
+    assert out.to_pylist() == [['<USER>', 'hi'], None, ['x']]
+
+class SlowKeepAll:
+    commutes = True
+
+    def process(self, text):
+        time.sleep(0.0005)
+        return list(text)
+
+    def explain(self):
+        return "Keep every word slowly"
+
+def test_pipeline_optimize_reorders_commuting_steps() -> None:
+    slow = SlowKeepAll()
+    punctuations = RemoveTokensWithOnlyPunctuations()
+    whitespace = RemoveWhiteSpaceOrChunksOfWhiteSpace()
+    usernames = ReplaceUsernames()
+    also_slow = SlowKeepAll()
+    pipeline = Pipeline([slow, punctuations, usernames, also_slow, whitespace], optimize=True, warmup=5, track_diffs=True)
+    reference = Pipeline([slow, punctuations, usernames, also_slow, whitespace])
+    text = ['@user', '...', 'hi', ' ', '🎉', '!!', 'there']
+
+    for _ in range(5):
+        assert pipeline.process(text) == reference.process(text)
+    assert pipeline.ordered_steps() == [punctuations, slow, usernames, whitespace, also_slow]
+    assert pipeline.process(text) == reference.process(text)
+    assert pipeline.diff_steps[-1] == pipeline.ordered_steps()
+    pipeline.explain(show_diffs=True)
+
+def test_pipeline_optimize_keeps_steps_that_raise_in_place() -> None:
+    steps = [SlowKeepAll(), RemoveWhiteSpaceOrChunksOfWhiteSpace(), RemoveTokensWithMajorityNonAlphabeticCharacters()]
+    pipeline = Pipeline(steps, optimize=True, warmup=3)
+    for _ in range(5):
+        assert pipeline.process(['', 'hi']) == ['hi']
+    assert pipeline.ordered_steps()[2] is steps[2]
+
+def test_step_fingerprint() -> None:
+    assert step_fingerprint(RemoveEmojis(ignored_emojis=['🎉', '🤔'])) == step_fingerprint(RemoveEmojis(ignored_emojis=['🤔', '🎉']))
+    assert step_fingerprint(RemoveEmojis()) != step_fingerprint(RemoveEmojis(ignored_emojis=['🎉']))
+    assert step_fingerprint(RemoveTokensWithMajorityNonAlphabeticCharacters(0.1)) != step_fingerprint(RemoveTokensWithMajorityNonAlphabeticCharacters(0.2))
+    assert step_fingerprint(ReplaceUsernames()) != step_fingerprint(ReplaceURLsandHTMLTags())
+
+def test_pipeline_cache_dir_resumes_from_longest_prefix(tmp_path) -> None:
+    texts = [['@user', 'hi', '🎉', 'a1b2c3'], ['google.com', 'x!!', 'plain']]
+    emojis = CountingStep(RemoveEmojis())
+    usernames = CountingStep(ReplaceUsernames())
+    cache_dir = str(tmp_path / "cache")
+
+    first = Pipeline([emojis, usernames, RemoveTokensWithMajorityNonAlphabeticCharacters(0.1)], cache_dir=cache_dir)
+    assert first.process_batch(texts) == [['hi'], ['google.com', 'plain']]
+    assert (emojis.calls, usernames.calls) == (1, 1)
+
+    tuned = Pipeline([emojis, usernames, RemoveTokensWithMajorityNonAlphabeticCharacters(0.6)], cache_dir=cache_dir)
+    expected = Pipeline([RemoveEmojis(), ReplaceUsernames(), RemoveTokensWithMajorityNonAlphabeticCharacters(0.6)]).process_batch(texts)
+    assert tuned.process_batch(texts, max_workers=2) == expected
+    assert (emojis.calls, usernames.calls) == (1, 1)
+
+    assert tuned.process_batch(texts[:1]) == expected[:1]
+    assert emojis.calls == 2
+
+    with pytest.raises(ValueError):
+        Pipeline([emojis], optimize=True, cache_dir=cache_dir)
+
+class Shout:
+    def process(self, text):
+        return [word.upper() for word in text]
+
+    def explain(self):
+        return "Shout every word"
+
+def test_pipeline_cache_dir_sees_edited_steps(tmp_path, monkeypatch) -> None:
+    cache_dir = str(tmp_path / "cache")
+    assert Pipeline([Shout()], cache_dir=cache_dir).process_batch([['Hi']]) == [['HI']]
+    monkeypatch.setattr(Shout, "process", lambda self, text: [word.lower() for word in text])
+    assert Pipeline([Shout()], cache_dir=cache_dir).process_batch([['Hi']]) == [['hi']]
+
+class PublicMap:
+    def __init__(self, function):
+        self.function = function
+
+    def process(self, text):
+        return [self.function(word) for word in text]
+
+    def explain(self):
+        return "Map every word"
+
+def test_pipeline_cache_dir_tells_functions_apart(tmp_path) -> None:
+    cache_dir = str(tmp_path / "cache")
+    suffix = '!'
+    assert Pipeline([PublicMap(lambda word: word.upper())], cache_dir=cache_dir).process_batch([['Hi']]) == [['HI']]
+    assert Pipeline([PublicMap(lambda word: word.lower())], cache_dir=cache_dir).process_batch([['Hi']]) == [['hi']]
+    assert Pipeline([PublicMap(lambda word: word + suffix)], cache_dir=cache_dir).process_batch([['Hi']]) == [['Hi!']]
+    suffix = '?'
+    assert Pipeline([PublicMap(lambda word: word + suffix)], cache_dir=cache_dir).process_batch([['Hi']]) == [['Hi?']]
+
+    with pytest.raises(ValueError):
+        Pipeline([Map(str.upper)], cache_dir=cache_dir)
+
+    def strip_first(word):
+        return strip_first(word[1:]) if word.startswith('#') else word
+    with pytest.raises(ValueError, match="refers to itself"):
+        Pipeline([PublicMap(strip_first)], cache_dir=cache_dir)
+
+def test_pipeline_graph_shares_prefix_steps() -> None:
+    usernames = CountingStep(ReplaceUsernames())
+    punctuations = CountingStep(RemoveTokensWithOnlyPunctuations())
+    graph = PipelineGraph({
+        'emojis_as_text': [usernames, punctuations, EmojiToText()],
+        'no_emojis': [usernames, punctuations, RemoveEmojis()],
+        'prefix_only': [usernames, punctuations],
+    })
+    text = ['@user', 'hi', '...', '🤔']
+
+    assert graph.process(text) == {
+        'emojis_as_text': ['<USER>', 'hi', ':thinking_face:'],
+        'no_emojis': ['<USER>', 'hi'],
+        'prefix_only': ['<USER>', 'hi', '🤔'],
+    }
+    assert (usernames.calls, punctuations.calls) == (1, 1)
+
+    results = graph.process_batch([text, ['plain']], max_workers=2)
+    assert results['no_emojis'] == [['<USER>', 'hi'], ['plain']]
+    assert results['prefix_only'] == [['<USER>', 'hi', '🤔'], ['plain']]
+    graph.explain()
+
+def test_pipeline_graph_merges_equal_steps() -> None:
+    graph = PipelineGraph({
+        'a': [ReplaceUsernames(), RemoveEmojis()],
+        'b': [ReplaceUsernames(), RemoveEmojis(ignored_emojis=['🎉'])],
+    })
+    assert len(graph._root.children) == 1
+    assert graph.process(['@user', '🎉']) == {'a': ['<USER>'], 'b': ['<USER>', '🎉']}
+
+class Map:
+    def __init__(self, function):
+        self._function = function
+
+    def process(self, text):
+        return [self._function(word) for word in text]
+
+    def explain(self):
+        return "Map every word"
+
+def test_pipeline_graph_shares_other_steps_only_by_identity() -> None:
+    upper = Map(lambda word: word.upper())
+    graph = PipelineGraph({
+        'upper': [upper, RemoveEmojis()],
+        'lower': [Map(lambda word: word.lower()), RemoveEmojis()],
+        'upper_again': [upper],
+    })
+    assert len(graph._root.children) == 2
+    assert graph.process(['Hi', '🎉']) == {'upper': ['HI'], 'lower': ['hi'], 'upper_again': ['HI', '🎉']}
+
+def test_pipeline_estimate() -> None:
+    pipeline = Pipeline([RemoveEmojis(), RemoveTokensWithOnlyPunctuations()])
+    source = (f"word{i} {'🎉 ' * (i % 2)}... end" for i in range(500))
+
+    estimate = pipeline.estimate(source, sample_size=100, tokenize=str.split, seed=0)
+    assert estimate.documents == 500
+    assert estimate.sample_size == 100
+    assert estimate.output_tokens == 1000
+    assert estimate.output_tokens_interval == (1000, 1000)
+    assert estimate.cpu_seconds_interval[0] <= estimate.cpu_seconds <= estimate.cpu_seconds_interval[1]
+    assert estimate.output_bytes > 0
+    assert 0 < estimate.steps[0]["drop_rate"] < 0.3
+    assert estimate.steps[1]["drop_rate"] == pytest.approx(1 / 3)
+    assert "Documents: 500 | Sampled: 100" in estimate.explain()
+
+def test_pipeline_estimate_small_source() -> None:
+    estimate = Pipeline([RemoveEmojis()]).estimate([['a', '🎉'], ['b']], sample_size=10)
+    assert (estimate.documents, estimate.sample_size, estimate.output_tokens) == (2, 2, 2)
+    assert Pipeline([RemoveEmojis()]).estimate([]).cpu_seconds == 0
+
+def test_pipeline_estimate_requires_tokenize_for_strings() -> None:
+    with pytest.raises(ValueError):
+        Pipeline([RemoveEmojis()]).estimate(["plain text"])
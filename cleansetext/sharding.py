@@ -0,0 +1,306 @@
+"""
+Resumable, sharded batch processing coordinated through a shared directory.
+
+`create_shards` splits the input documents into shard files and writes a manifest. Any number of
+`ShardedRunner` workers, in local processes or on other machines that see the same directory,
+then claim shards through atomic lock files, run a `Pipeline` over them and write one output file
+per shard. Progress is checkpointed, so a restarted worker skips finished shards and resumes
+unfinished ones from their last checkpoint.
+
+Layout of the directory:
+    manifest.json               The list of shards.
+    shards/<shard>.jsonl        One input document per line, a JSON string or a JSON list of words.
+    locks/<shard>.lock          Held by the worker processing the shard, with a token unique to that claim
+                                and the host and pid of the worker.
+    outputs/<shard>.<token>.jsonl.part
+                                The output written so far by the owner of a claim, one JSON list of words per line.
+    outputs/<shard>.ckpt        The .part file, number of documents and bytes of the last checkpoint.
+    outputs/<shard>.jsonl       The finished output of the shard.
+
+A worker checks that its token is still in the lock before every checkpoint and before publishing
+the output of a shard, so a worker whose stale lock was taken over stops without touching the
+progress of the new owner.
+"""
+import json
+import os
+import socket
+import time
+import uuid
+
+MANIFEST_NAME = "manifest.json"
+
+class _LostLock(Exception):
+    """Raised when another worker has taken over the lock of the shard being processed."""
+
+def _write_atomic(path, data):
+    """Write a file so that readers see either the old or the new content, never a partial one."""
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def create_shards(directory, documents, shard_size=10000):
+    """
+    Split documents into shard files and write the manifest of a sharded job.
+
+    Args:
+        directory (str): The shared directory of the job. It is created if it does not exist.
+        documents (iterable): The documents, each a string or a list of words.
+        shard_size (int): The number of documents per shard. Default is 10000.
+
+    Returns:
+        list: The shard ids, in input order.
+    """
+    if os.path.exists(os.path.join(directory, MANIFEST_NAME)):
+        raise FileExistsError(f"A manifest already exists in {directory}")
+    for sub_directory in ("shards", "locks", "outputs"):
+        os.makedirs(os.path.join(directory, sub_directory), exist_ok=True)
+
+    shards = []
+    shard_file = None
+    for index, document in enumerate(documents):
+        if index % shard_size == 0:
+            if shard_file is not None:
+                shard_file.close()
+            shard_id = f"{len(shards):05d}"
+            shards.append({"id": shard_id, "documents": 0})
+            shard_file = open(os.path.join(directory, "shards", f"{shard_id}.jsonl"), 'w', encoding='utf-8')
+        shard_file.write(json.dumps(document, ensure_ascii=False) + "\n")
+        shards[-1]["documents"] += 1
+    if shard_file is not None:
+        shard_file.close()
+
+    # The manifest is written last, so workers never see a job whose shards are incomplete
+    _write_atomic(os.path.join(directory, MANIFEST_NAME), json.dumps({"shards": shards}, indent=2))
+    return [shard["id"] for shard in shards]
+
+
+class ShardedRunner:
+    """
+    A class to run a `Pipeline` over the shards of a job created with `create_shards`.
+
+    Args:
+        directory (str): The shared directory of the job.
+        pipeline (Pipeline): The pipeline to run over every document.
+        tokenize (callable): A function splitting string documents into a list of words. Default is `str.split`.
+        checkpoint_every (int): The number of documents processed between two checkpoints. Default is 1000.
+        lock_timeout (float): The number of seconds after which the lock of a worker that stopped checkpointing
+            is considered stale and its shard can be taken over. Locks of processes of the same host that
+            no longer run are stale right away. Default is 600.
+
+    Example:
+        create_shards('job', documents, shard_size=10000)
+        ShardedRunner('job', pipeline).run()
+        results = list(ShardedRunner('job', pipeline).iter_results())
+    """
+    def __init__(self, directory, pipeline, tokenize=str.split, checkpoint_every=1000, lock_timeout=600):
+        """Initialize the ShardedRunner instance with the given job directory and pipeline."""
+        self.directory = directory
+        self.pipeline = pipeline
+        self.tokenize = tokenize
+        self.checkpoint_every = checkpoint_every
+        self.lock_timeout = lock_timeout
+        with open(os.path.join(directory, MANIFEST_NAME), encoding='utf-8') as f:
+            self.shards = [shard["id"] for shard in json.load(f)["shards"]]
+
+    def _path(self, sub_directory, name):
+        return os.path.join(self.directory, sub_directory, name)
+
+    def is_done(self, shard_id):
+        """Return True if the output of the shard is complete."""
+        return os.path.exists(self._path("outputs", f"{shard_id}.jsonl"))
+
+    def is_complete(self):
+        """Return True if every shard of the job is complete."""
+        return all(self.is_done(shard_id) for shard_id in self.shards)
+
+    def _read_lock(self, lock_path):
+        """Return the content of a lock file, with its token, host and pid, or an empty dict if it cannot be read."""
+        try:
+            with open(lock_path, encoding='utf-8') as f:
+                lock = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        return lock if isinstance(lock, dict) else {}
+
+    def _owns(self, shard_id, token):
+        """Return True if the lock of the shard still holds the given token."""
+        return self._read_lock(self._path("locks", f"{shard_id}.lock")).get("token") == token
+
+    def _owner_is_dead(self, lock):
+        """Return True if the lock was taken by a process of this host that no longer runs."""
+        pid = lock.get("pid")
+        if lock.get("host") != socket.gethostname() or not isinstance(pid, int) or pid == os.getpid():
+            return False
+        # Signal 0 would terminate the process on Windows, where the lock is left to expire instead
+        if os.name == 'nt':
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            return False
+        return False
+
+    def _claim(self, shard_id):
+        """Try to take the lock of a shard, taking over stale locks. Returns the token of the lock, or None."""
+        lock_path = self._path("locks", f"{shard_id}.lock")
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            lock = self._read_lock(lock_path)
+            # A lock left by a crashed process of this host is stale right away, other locks once they expire
+            dead = self._owner_is_dead(lock)
+            try:
+                age = time.time() - os.path.getmtime(lock_path)
+            except FileNotFoundError:
+                return self._claim(shard_id)
+            if age < self.lock_timeout and not dead:
+                return None
+            # Move the stale lock aside atomically, only one of the competing workers succeeds
+            stale_path = f"{lock_path}.{uuid.uuid4().hex}.stale"
+            try:
+                os.rename(lock_path, stale_path)
+            except FileNotFoundError:
+                return None
+            # Another worker may have taken the lock over between the check and the rename,
+            # in which case the file moved aside is its fresh lock and has to be put back
+            fresh = self._read_lock(stale_path).get("token") != lock.get("token")
+            if not fresh and not dead:
+                fresh = time.time() - os.stat(stale_path).st_mtime < self.lock_timeout
+            if fresh:
+                try:
+                    os.link(stale_path, lock_path)
+                except FileExistsError:
+                    pass
+                os.remove(stale_path)
+                return None
+            os.remove(stale_path)
+            return self._claim(shard_id)
+        token = uuid.uuid4().hex
+        with os.fdopen(fd, 'w') as f:
+            f.write(json.dumps({"token": token, "host": socket.gethostname(), "pid": os.getpid(), "time": time.time()}))
+        return token
+
+    def _release(self, shard_id, token):
+        """Remove the lock of a shard, unless another worker has taken it over."""
+        if not self._owns(shard_id, token):
+            return
+        try:
+            os.remove(self._path("locks", f"{shard_id}.lock"))
+        except FileNotFoundError:
+            pass
+
+    def _read_checkpoint(self, shard_id):
+        """Return the last checkpoint of a shard, with its number of documents, bytes and .part file, or None."""
+        try:
+            with open(self._path("outputs", f"{shard_id}.ckpt"), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _checkpoint(self, shard_id, token, output, part_name, documents):
+        output.flush()
+        os.fsync(output.fileno())
+        # A worker whose lock was taken over must not overwrite the progress of the new owner
+        if not self._owns(shard_id, token):
+            raise _LostLock(shard_id)
+        _write_atomic(self._path("outputs", f"{shard_id}.ckpt"), json.dumps({"documents": documents, "bytes": output.tell(), "part": part_name}))
+        # Refresh the lock so that other workers do not consider it stale
+        os.utime(self._path("locks", f"{shard_id}.lock"))
+
+    def _process_shard(self, shard_id, token):
+        checkpoint = self._read_checkpoint(shard_id)
+        # Every owner writes its own .part file, so a worker that lost its lock cannot corrupt the output of the next one
+        part_name = f"{shard_id}.{token}.jsonl.part"
+        part_path = self._path("outputs", part_name)
+        previous_part_path = None
+        done_documents = 0
+        try:
+            with open(part_path, 'wb') as output:
+                if checkpoint is not None:
+                    previous_part_path = self._path("outputs", checkpoint["part"])
+                    try:
+                        # Copy the checkpointed output, dropping anything written after it by a worker that crashed
+                        with open(previous_part_path, 'rb') as previous:
+                            remaining = checkpoint["bytes"]
+                            while remaining > 0:
+                                block = previous.read(min(remaining, 1 << 20))
+                                if not block:
+                                    break
+                                output.write(block)
+                                remaining -= len(block)
+                        if remaining == 0:
+                            done_documents = checkpoint["documents"]
+                        else:
+                            output.seek(0)
+                            output.truncate()
+                    except FileNotFoundError:
+                        pass
+                documents = done_documents
+                with open(self._path("shards", f"{shard_id}.jsonl"), encoding='utf-8') as shard:
+                    for index, line in enumerate(shard):
+                        if index < done_documents:
+                            continue
+                        document = json.loads(line)
+                        text = self.tokenize(document) if isinstance(document, str) else document
+                        output.write((json.dumps(self.pipeline.process(text), ensure_ascii=False) + "\n").encode('utf-8'))
+                        documents += 1
+                        if documents % self.checkpoint_every == 0:
+                            self._checkpoint(shard_id, token, output, part_name, documents)
+                output.flush()
+                os.fsync(output.fileno())
+            if not self._owns(shard_id, token):
+                raise _LostLock(shard_id)
+        except _LostLock:
+            os.remove(part_path)
+            raise
+        os.replace(part_path, self._path("outputs", f"{shard_id}.jsonl"))
+        for path in (self._path("outputs", f"{shard_id}.ckpt"), previous_part_path):
+            try:
+                if path is not None:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def run(self):
+        """
+        Process every shard that is neither finished nor held by another worker.
+
+        Returns:
+            list: The ids of the shards processed by this worker.
+        """
+        processed = []
+        for shard_id in self.shards:
+            if self.is_done(shard_id):
+                continue
+            token = self._claim(shard_id)
+            if token is None:
+                continue
+            try:
+                # Another worker may have finished the shard between the check and the claim
+                if not self.is_done(shard_id):
+                    self._process_shard(shard_id, token)
+                    processed.append(shard_id)
+            except _LostLock:
+                continue
+            finally:
+                self._release(shard_id, token)
+        return processed
+
+    def iter_results(self):
+        """
+        Iterate over the processed documents of a complete job, in input order.
+
+        Yields:
+            list: The processed list of words of every document.
+        """
+        if not self.is_complete():
+            raise RuntimeError("The job has unfinished shards, run the workers to completion first")
+        for shard_id in self.shards:
+            with open(self._path("outputs", f"{shard_id}.jsonl"), encoding='utf-8') as f:
+                for line in f:
+                    yield json.loads(line)
@@ -0,0 +1,144 @@
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from cleansetext.pipeline import Pipeline
+from cleansetext.sharding import ShardedRunner, create_shards
+from cleansetext.steps import *
+
+def make_pipeline():
+    return Pipeline([RemoveEmojis(), ReplaceUsernames(), RemoveTokensWithOnlyPunctuations()])
+
+def make_documents(n):
+    return [f"@user{i} says hello {i} times 🎉 !!" for i in range(n)]
+
+def run_worker(directory):
+    ShardedRunner(directory, make_pipeline(), checkpoint_every=3).run()
+
+class FailAfter:
+    def __init__(self, calls):
+        self.calls = calls
+
+    def process(self, text):
+        if self.calls == 0:
+            raise RuntimeError("worker crashed")
+        self.calls -= 1
+        return text
+
+    def explain(self):
+        return "Fail after a number of calls"
+
+def test_create_shards(tmp_path):
+    assert create_shards(str(tmp_path), make_documents(25), shard_size=10) == ['00000', '00001', '00002']
+    with pytest.raises(FileExistsError):
+        create_shards(str(tmp_path), make_documents(25), shard_size=10)
+
+def test_sharded_runner_with_several_processes(tmp_path):
+    directory = str(tmp_path)
+    documents = make_documents(100)
+    create_shards(directory, documents, shard_size=7)
+
+    workers = [multiprocessing.Process(target=run_worker, args=(directory,)) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    runner = ShardedRunner(directory, make_pipeline())
+    assert runner.is_complete()
+    assert list(runner.iter_results()) == [make_pipeline().process(document.split()) for document in documents]
+    assert runner.run() == []
+
+def test_sharded_runner_resumes_from_checkpoint(tmp_path):
+    directory = str(tmp_path)
+    documents = make_documents(10)
+    create_shards(directory, documents, shard_size=10)
+
+    with pytest.raises(RuntimeError):
+        ShardedRunner(directory, Pipeline([FailAfter(7)]), checkpoint_every=3).run()
+    assert not os.path.exists(os.path.join(directory, "locks", "00000.lock"))
+
+    # Six documents were checkpointed, only the remaining four are processed again
+    counter = FailAfter(4)
+    runner = ShardedRunner(directory, Pipeline([counter]), checkpoint_every=3)
+    assert runner.run() == ['00000']
+    assert counter.calls == 0
+    assert list(runner.iter_results()) == [document.split() for document in documents]
+
+def test_sharded_runner_respects_and_takes_over_locks(tmp_path):
+    directory = str(tmp_path)
+    create_shards(directory, make_documents(4), shard_size=2)
+    lock_path = os.path.join(directory, "locks", "00000.lock")
+    open(lock_path, 'w').close()
+
+    assert ShardedRunner(directory, make_pipeline()).run() == ['00001']
+    with pytest.raises(RuntimeError):
+        list(ShardedRunner(directory, make_pipeline()).iter_results())
+
+    stale = time.time() - 3600
+    os.utime(lock_path, (stale, stale))
+    runner = ShardedRunner(directory, make_pipeline(), lock_timeout=60)
+    assert runner.run() == ['00000']
+    assert runner.is_complete()
+
+def test_sharded_runner_takes_over_a_stale_lock_only_once(tmp_path, monkeypatch):
+    directory = str(tmp_path)
+    create_shards(directory, make_documents(2), shard_size=2)
+    lock_path = os.path.join(directory, "locks", "00000.lock")
+    open(lock_path, 'w').close()
+    stale = time.time() - 3600
+    os.utime(lock_path, (stale, stale))
+
+    # Both workers judge the lock stale, as if they had checked it before either took it over
+    monkeypatch.setattr(os.path, "getmtime", lambda path: stale)
+    first = ShardedRunner(directory, make_pipeline(), lock_timeout=60)
+    second = ShardedRunner(directory, make_pipeline(), lock_timeout=60)
+    token = first._claim('00000')
+    assert token is not None
+    assert second._claim('00000') is None
+    assert first._owns('00000', token)
+    assert os.listdir(os.path.join(directory, "locks")) == ["00000.lock"]
+
+class TakeOverLock:
+    def __init__(self, lock_path):
+        self.lock_path = lock_path
+
+    def process(self, text):
+        with open(self.lock_path, 'w') as f:
+            f.write('{"token": "other worker"}')
+        return text
+
+    def explain(self):
+        return "Let another worker take over the lock"
+
+def test_sharded_runner_stops_after_losing_its_lock(tmp_path):
+    directory = str(tmp_path)
+    create_shards(directory, make_documents(4), shard_size=4)
+    lock_path = os.path.join(directory, "locks", "00000.lock")
+
+    runner = ShardedRunner(directory, Pipeline([TakeOverLock(lock_path)]), checkpoint_every=2)
+    assert runner.run() == []
+    assert not runner.is_done('00000')
+    assert not os.path.exists(os.path.join(directory, "outputs", "00000.ckpt"))
+    assert os.listdir(os.path.join(directory, "outputs")) == []
+    # The lock of the new owner is left alone
+    with open(lock_path) as f:
+        assert f.read() == '{"token": "other worker"}'
+
+def test_sharded_runner_reclaims_the_lock_of_a_dead_process(tmp_path):
+    directory = str(tmp_path)
+    create_shards(directory, make_documents(2), shard_size=2)
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    with open(os.path.join(directory, "locks", "00000.lock"), 'w') as f:
+        f.write(json.dumps({"token": "crashed", "host": socket.gethostname(), "pid": dead.pid, "time": time.time()}))
+
+    runner = ShardedRunner(directory, make_pipeline())
+    assert runner.run() == ['00000']
+    assert runner.is_complete()
@@ -1,7 +1,77 @@
+"""
+Preprocessing steps for `cleansetext.pipeline.Pipeline`.
+
+Every step is configured in `__init__` and never mutates itself in `process`, so a single
+instance can be shared between threads, including on free-threaded Python builds.
+
+Besides `process` and `explain`, steps carry two attributes used by the pipeline:
+`triggers`, the features from `scan_features` that can make the step change a document
+(None if it must always run), and `commutes`, which is True for steps that only keep or drop
+each word on its own, so that any run of them gives the same output in any order.
+"""
 import nltk
 import emoji
+import hashlib
+import html
+import os
+import pickle
 import re
 import string
+import threading
+from collections import deque
+from html.entities import html5
+
+HAS_AT = "has_at"
+HAS_DOT = "has_dot"
+HAS_AMPERSAND = "has_ampersand"
+HAS_NON_ASCII = "has_non_ascii"
+HAS_PUNCTUATION = "has_punctuation"
+HAS_EMPTY_TOKEN = "has_empty_token"
+HAS_LESS_THAN = "has_less_than"
+
+_PUNCTUATION_CHARS = frozenset(string.punctuation)
+
+def scan_features(text):
+    """
+    Compute a cheap character-class summary of a list of words.
+
+    Steps declare the features that can trigger them through a `triggers` attribute,
+    which lets `Pipeline` skip a step entirely when none of its features are present.
+    A step with `triggers = None` is always run.
+
+    Args:
+        text (list): A list of words to scan.
+
+    Returns:
+        frozenset: The features present in the list of words.
+
+    Example:
+        scan_features(['hi', '@user'])
+        >> frozenset({'has_at', 'has_punctuation'})
+    """
+    joined = ''.join(text)
+    features = []
+    if '@' in joined:
+        features.append(HAS_AT)
+    if '.' in joined:
+        features.append(HAS_DOT)
+    if '&' in joined:
+        features.append(HAS_AMPERSAND)
+    if not joined.isascii():
+        features.append(HAS_NON_ASCII)
+    if not _PUNCTUATION_CHARS.isdisjoint(joined):
+        features.append(HAS_PUNCTUATION)
+    if not all(text):
+        features.append(HAS_EMPTY_TOKEN)
+    if '<' in joined:
+        features.append(HAS_LESS_THAN)
+    return frozenset(features)
+
+def _punctuation_triggers(punctuations):
+    """Return the triggers of a punctuation based step, or None if it must always run."""
+    if _PUNCTUATION_CHARS.issuperset(punctuations):
+        return frozenset([HAS_PUNCTUATION, HAS_EMPTY_TOKEN])
+    return None
 
 class StopWordsRemover:
     """
@@ -18,6 +88,9 @@ class StopWordsRemover:
         remover.process(['this', 'is', 'a', 'test'])
         >> ['test']
     """
+    triggers = None
+    commutes = False
+
     def __init__(self, ignore_case=True, ignored_stopwords=None, include_stopwords=None, language='english'):
         """Initialize the StopWordsRemover instance with the given parameters."""
         nltk.download('stopwords')
@@ -70,6 +143,9 @@ class EmojiToText:
         emoji_to_text.process(['this', 'is', 'a', 'test', '🤔'])
         >> ['this', 'is', 'a', 'test', ':thinking_face:']
     """
+    triggers = frozenset([HAS_NON_ASCII])
+    commutes = False
+
     def __init__(self, language='en'):
         """Initialize the EmojiToText instance with the given language."""
         self.language = language
@@ -108,6 +184,9 @@ class TextToEmoji:
         text_to_emoji.process(['this', 'is', 'a', 'test', ':thinking_face:'])
         >> ['this', 'is', 'a', 'test', '🤔']
     """
+    triggers = frozenset([HAS_PUNCTUATION])
+    commutes = False
+
     def __init__(self, language='en'):
         """Initialize the TextToEmoji instance with the given language."""
         self.language = language
@@ -146,9 +225,12 @@ class RemoveEmojis:
         remover.process(['this', 'is', 'a', 'test', '🤔'])
         >> ['this', 'is', 'a', 'test']
     """
+    triggers = frozenset([HAS_NON_ASCII])
+    commutes = True
+
     def __init__(self, ignored_emojis=None):
         """Initialize the RemoveEmojis instance with the given ignored emojis."""
-        self.ignored_emojis = ignored_emojis
+        self.ignored_emojis = set(ignored_emojis) if ignored_emojis is not None else set()
 
     def process(self, text):
         """
@@ -160,11 +242,6 @@ class RemoveEmojis:
         Returns:
             list: A list of words with emojis removed.
         """
-        if self.ignored_emojis is not None:
-            self.ignored_emojis = set(self.ignored_emojis)
-        else:
-            self.ignored_emojis = set()
-        
         new_text = []
         for word in text:
             if emoji.demojize(word) != word and word not in self.ignored_emojis:
@@ -196,6 +273,9 @@ class RemovePrecedingAndTrailingPunctuations:
         remover.process(['.', 'this', 'is', 'a', 'test', '.', '.'])
         >> ['this', 'is', 'a', 'test']
     """
+    triggers = None
+    commutes = False
+
     def __init__(self, punctuations='!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~', ignore_starting_punctuations=False, ignore_ending_punctuations=False):
         """
         Initialize the RemovePrecedingAndTrailingPunctuations instance with the given punctuations and ignore flags.
@@ -253,6 +333,8 @@ class RemoveAllPunctuations:
         remover.process(['.', 'this', 'is', 'a', '.', 'test', '.', '.'])
         >> ['this', 'is', 'a', 'test']
     """
+    commutes = True
+
     def __init__(self, punctuations='!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~'):
         """
         Initialize the RemoveAllPunctuations instance with the given punctuation characters.
@@ -261,6 +343,7 @@ class RemoveAllPunctuations:
             punctuations (str): A string of punctuation characters to remove.
         """
         self.punctuations = punctuations
+        self.triggers = _punctuation_triggers(punctuations)
 
     def process(self, text):
         """
@@ -293,6 +376,9 @@ class RemoveAllNonAlphabetOnlyWords:
         remover.process(['.', 'this', 'is', 'a', 'test', '9', '🤔'])
         >> ['this', 'is', 'a', 'test', '9]
     """
+    triggers = None
+    commutes = True
+
     def __init__(self):
         """Initialize the RemoveAllNonAlphabetOnlyWords instance."""
         pass
@@ -332,6 +418,9 @@ class RemoveAllNonAlphanumericOnlyWords:
         remover.process(['.', 'this', 'is', 'a', 'test', '9', '🤔'])
         >> ['this', 'is', 'a', 'test', '9']
     """
+    triggers = None
+    commutes = True
+
     def __init__(self):
         """Initialize the RemoveAllNonAlphanumericOnlyWords instance."""
         pass
@@ -371,6 +460,9 @@ class RemoveAllNonNumericOnlyWords:
         remover.process(['.', 'this', 'is', 'a', 'test', '9', '🤔'])
         >> ['9']
     """
+    triggers = None
+    commutes = True
+
     def __init__(self):
         """Initialize the RemoveAllNonNumericOnlyWords instance."""
         pass
@@ -408,6 +500,8 @@ class RemoveTokensWithOnlyPunctuations:
         remover.process(['.(', 'this', 'is', 'a', 'test', '?.', '....'])
         >> ['this', 'is', 'a', 'test']
     """
+    commutes = True
+
     def __init__(self, punctuations='!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~'):
         """
         Initialize the RemoveTokensWithOnlyPunctuations instance.
@@ -416,6 +510,7 @@ class RemoveTokensWithOnlyPunctuations:
             punctuations (str): A string of punctuation characters to remove.
         """
         self.punctuations = punctuations
+        self.triggers = _punctuation_triggers(punctuations)
 
     def process(self, text):
         """
@@ -450,6 +545,10 @@ class RemoveTokensWithMajorityNonAlphabeticCharacters:
         remover.process(['.(', 'this', 'is', 'a', 'test', '?.', '....'])
         >> ['this', 'is', 'a', 'test']
     """
+    triggers = None
+    # Raises on empty words, which a filter running before it in the declared order may have removed
+    commutes = False
+
     def __init__(self, threshold=0.1):
         """
         Initialize the RemoveTokensWithMajorityNonAlphabeticCharacters instance.
@@ -481,24 +580,28 @@ class RemoveTokensWithMajorityNonAlphabeticCharacters:
         return f"Remove tokens with majority non alphabetic characters from a list of words | Threshold: {self.threshold}"
 
 
+URL_REGEX = r"(?:http://|https://)?[A-Za-z0-9_]+\.[a-z][A-Za-z0-9_]{1,}[\.A-Za-z0-9_]*[/?[A-Za-z0-9_~]*]*\.?[A-Za-z0-9_]*\b"
+HTML_ENTITY_REGEX = r"&quot;|&amp;|&lt;"
+USERNAME_REGEX = r"(?<=^|(?<=[^a-zA-Z0-9-_\.]))@([A-Za-z]+[A-Za-z0-9_]+)"
+
+_URL_PATTERN = re.compile(URL_REGEX)
+_USERNAME_PATTERN = re.compile(USERNAME_REGEX)
+_FALSE_POSITIVE_URL_COMPONENT = re.compile(r'^(but|don|we|what|you|night|since|especially|keep|lol|and|last)$', re.IGNORECASE)
+_NUMERIC_URL_COMPONENT = re.compile(r'^[0-9_]*$')
+
+def _isURL(candidate):
+  for comps in candidate.split("."):
+    if _FALSE_POSITIVE_URL_COMPONENT.search(comps) or _NUMERIC_URL_COMPONENT.search(comps):
+      return False
+  return True
+
 def findURLsandHTML(sentence):
-  falsePositiveIndicators = ['but', 'don', 'we', 'what', 'you', 'night', 'since', 'especially', 'keep', 'lol', 'and', 'last']
-  falsePositiveIndicatorsRegex = re.compile(r'^(' + r'|'.join(falsePositiveIndicators) + r')$', re.IGNORECASE)
-  urls = re.findall("(?:http://|https://)?[A-Za-z0-9_]+\.[a-z][A-Za-z0-9_]{1,}[\.A-Za-z0-9_]*[/?[A-Za-z0-9_~]*]*\.?[A-Za-z0-9_]*\\b", sentence)
-  all_urls = []
-  for url in urls:
-    dummy = re.split("\.", url)
-    shouldAdd = True
-    for comps in dummy:
-      if (re.search(falsePositiveIndicatorsRegex, comps) or re.search("^[0-9_]*$", comps)):
-        shouldAdd = False
-    if shouldAdd:
-      all_urls.append(url)
-  if re.search("&quot;", sentence):
+  all_urls = [url for url in _URL_PATTERN.findall(sentence) if _isURL(url)]
+  if "&quot;" in sentence:
     all_urls.append("&quot;")
-  if re.search("&amp;", sentence):
+  if "&amp;" in sentence:
     all_urls.append("&amp;")
-  if re.search("&lt;", sentence):
+  if "&lt;" in sentence:
     all_urls.append("&lt;")
   return all_urls
 
@@ -514,6 +617,9 @@ class ReplaceURLsandHTMLTags:
     >>> remover.process(['this', 'is', 'a', 'test', 'google.com'])
     ['this', 'is', 'a', 'test', '<URL>']
     """
+    triggers = frozenset([HAS_DOT, HAS_AMPERSAND])
+    commutes = False
+
     def __init__(self, replace_with="<URL>"):
         self.replace_with = replace_with
 
@@ -533,7 +639,7 @@ class ReplaceURLsandHTMLTags:
         return "Remove URLs and HTML tags from a sentence | Replace with: {}".format(self.replace_with)
 
 def findUsernames(sentence):
-  return re.findall("(?<=^|(?<=[^a-zA-Z0-9-_\.]))@([A-Za-z]+[A-Za-z0-9_]+)", sentence)
+  return _USERNAME_PATTERN.findall(sentence)
 
 class ReplaceUsernames:
     """
@@ -547,6 +653,9 @@ class ReplaceUsernames:
     >>> remover.process(['this', 'is', 'a', 'test', '@user'])
     ['this', 'is', 'a', 'test', '<USER>']
     """
+    triggers = frozenset([HAS_AT])
+    commutes = False
+
     def __init__(self, replace_with="<USER>"):
         self.replace_with = replace_with
 
@@ -565,6 +674,196 @@ class ReplaceUsernames:
     def explain(self):
         return "Remove usernames from a sentence | Replace with: {}".format(self.replace_with)
 
+_PATTERN_FLAGS = ((re.ASCII, 'a'), (re.IGNORECASE, 'i'), (re.MULTILINE, 'm'), (re.DOTALL, 's'), (re.VERBOSE, 'x'))
+_LEADING_GLOBAL_FLAGS = re.compile(r"^\(\?[aiLmsux]+\)")
+_NUMBERED_GROUP_REFERENCE = re.compile(r"(?<!\\)(?:\\\\)*(?:\\[1-9]|\(\?\([0-9]+\))")
+_RESERVED_GROUP_NAME = re.compile(r"_p[0-9]+")
+
+def _scoped_pattern(name, pattern):
+    """
+    Turn a custom pattern into text that can be embedded in a larger alternation, with its flags scoped to it.
+
+    Returns:
+        tuple: The text of the pattern and the set of its group names.
+    """
+    compiled = re.compile(pattern)
+    text = compiled.pattern
+    while _LEADING_GLOBAL_FLAGS.match(text):
+        text = _LEADING_GLOBAL_FLAGS.sub("", text, count=1)
+    if _NUMBERED_GROUP_REFERENCE.search(text):
+        raise ValueError(f"The pattern {name} refers to a group by number, which changes once the patterns are combined. "
+                         "Use a named group (?P<name>...) and refer to it with (?P=name) instead.")
+    names = set(compiled.groupindex)
+    for group_name in names:
+        if _RESERVED_GROUP_NAME.fullmatch(group_name):
+            raise ValueError(f"The group name {group_name} of the pattern {name} is reserved.")
+    flags = "".join(letter for flag, letter in _PATTERN_FLAGS if compiled.flags & flag)
+    if flags:
+        text = f"(?{flags}:{text})"
+    return text, names
+
+
+class ReplacePatterns:
+    """
+    A class to replace URLs, HTML entities, usernames and custom patterns in a single pass over every word.
+
+    All patterns are compiled into one combined regular expression, so every word is scanned once however many
+    patterns there are. When several patterns match at the same position, the one listed first wins, in the order
+    custom patterns, URLs, HTML entities, then usernames. The flags of each custom pattern only apply to that pattern.
+    Custom patterns may use named groups, but not refer to groups by number, as their numbers change once combined.
+
+    Configured like `ReplaceURLsandHTMLTags` followed by `ReplaceUsernames`, it differs in two ways. It only replaces
+    the occurrences the regular expression matched, where the older steps replace every occurrence of a matched
+    string, e.g. '@bob@bob' gives '<USER>@bob' here and '<USER><USER>' with `ReplaceUsernames`, as the second
+    '@bob' follows a letter and is not a username on its own. And on words where a URL and a username overlap,
+    the one found first wins instead of both being replaced in turn.
+
+    Expected input: list of words
+    Expected output: list of words
+
+    Args:
+        patterns (dict): Custom patterns to replace, as a mapping of name to regular expression, either a string or
+            a compiled pattern. Default is no custom patterns.
+        replace_with (dict): The replacement of each pattern name. Defaults are '<URL>' for URLs and HTML entities,
+            '<USER>' for usernames and '<NAME>' for a custom pattern called NAME.
+        replace_urls (bool): If set to True, replace URLs and HTML entities like `ReplaceURLsandHTMLTags`. Default is True.
+        replace_usernames (bool): If set to True, replace usernames like `ReplaceUsernames`. Default is True.
+
+    Example:
+    >>> replacer = ReplacePatterns(patterns={'HASHTAG': '#[A-Za-z0-9_]+'})
+    >>> replacer.process(['#tbt', 'with', '@user', 'at', 'google.com'])
+    ['<HASHTAG>', 'with', '<USER>', 'at', '<URL>']
+    """
+    commutes = False
+
+    def __init__(self, patterns=None, replace_with=None, replace_urls=True, replace_usernames=True):
+        self.patterns = dict(patterns) if patterns else {}
+        self.replace_urls = replace_urls
+        self.replace_usernames = replace_usernames
+
+        # Custom patterns come first, so that e.g. an email pattern wins over the URL inside the email
+        named_patterns = []
+        group_names = set()
+        builtin_names = {"URL"} if replace_urls else set()
+        if replace_usernames:
+            builtin_names.add("USER")
+        for name, pattern in self.patterns.items():
+            if name in builtin_names:
+                raise ValueError(f"The pattern name {name} is already used by a built-in pattern.")
+            text, names = _scoped_pattern(name, pattern)
+            duplicates = group_names & names
+            if duplicates:
+                raise ValueError(f"The group name {sorted(duplicates)[0]} of the pattern {name} is already used by another pattern.")
+            group_names |= names
+            named_patterns.append((name, text))
+        if replace_urls:
+            named_patterns.append(("URL", URL_REGEX))
+            named_patterns.append(("URL", HTML_ENTITY_REGEX))
+        if replace_usernames:
+            named_patterns.append(("USER", USERNAME_REGEX))
+        if not named_patterns:
+            raise ValueError("At least one of patterns, replace_urls or replace_usernames must be defined.")
+
+        self.replace_with = {name: f"<{name}>" for name, _ in named_patterns}
+        if replace_with:
+            self.replace_with.update(replace_with)
+        # Every alternative gets its own group, so the name of the last group closed tells which one matched
+        self._group_names = {f"_p{index}": name for index, (name, _) in enumerate(named_patterns)}
+        self._pattern = re.compile("|".join(f"(?P<_p{index}>{pattern})" for index, (_, pattern) in enumerate(named_patterns)))
+        self._url_group = f"_p{len(self.patterns)}" if replace_urls else None
+
+        if self.patterns:
+            self.triggers = None
+        else:
+            triggers = []
+            if replace_urls:
+                triggers.extend([HAS_DOT, HAS_AMPERSAND])
+            if replace_usernames:
+                triggers.append(HAS_AT)
+            self.triggers = frozenset(triggers)
+
+    def _replace(self, match):
+        group = match.lastgroup
+        if group == self._url_group and not _isURL(match.group(0)):
+            return match.group(0)
+        return self.replace_with[self._group_names[group]]
+
+    def process(self, text):
+        pattern = self._pattern
+        replace = self._replace
+        return [pattern.sub(replace, word) for word in text]
+
+    def explain(self):
+        return "Replace patterns in a sentence | Replace with: {}".format(self.replace_with)
+
+# Named entities that end with a semicolon, by name, e.g. 'amp' -> '&'
+_HTML_NAMED_ENTITIES = {name[:-1]: value for name, value in html5.items() if name.endswith(';')}
+_HTML_PATTERN = re.compile(
+    r"(?P<tag><!--.*?-->|</?[A-Za-z][^<>]*>)"
+    r"|&(?:(?P<numeric>#[0-9]+|#[xX][0-9A-Fa-f]+)|(?P<named>[A-Za-z][A-Za-z0-9]*));",
+    re.DOTALL,
+)
+
+class UnescapeOrStripHTML:
+    """
+    A class to decode or replace HTML tags, named entities and numeric entities in a list of words.
+
+    Tags, named entities and numeric entities are found by a single compiled pattern, and named entities are looked up
+    in a table built once from the HTML5 entity list. Words without '&' or '<' are passed through without being scanned.
+    Placeholders such as '<URL>' look like tags, so run this step before the steps that insert them.
+
+    Expected input: list of words
+    Expected output: list of words
+
+    Args:
+        mode (str): 'decode' to strip tags and decode entities into the characters they stand for, or 'replace' to
+            replace every tag and entity with `replace_with`. Unknown named entities are left untouched. Default is 'decode'.
+        replace_with (str): The replacement of tags and entities in 'replace' mode. Default is '<HTML>'.
+        drop_empty (bool): If set to True, drop words that were only made of tags. Default is True.
+
+    Example:
+    >>> decoder = UnescapeOrStripHTML()
+    >>> decoder.process(['fish', '&amp;', 'chips', '<br/>', 'it&#39;s', 'caf&eacute;'])
+    ['fish', '&', 'chips', "it's", 'café']
+    """
+    triggers = frozenset([HAS_AMPERSAND, HAS_LESS_THAN])
+    commutes = False
+
+    def __init__(self, mode='decode', replace_with="<HTML>", drop_empty=True):
+        if mode not in ('decode', 'replace'):
+            raise ValueError("mode must be either 'decode' or 'replace'.")
+        self.mode = mode
+        self.replace_with = replace_with
+        self.drop_empty = drop_empty
+
+    def _decode(self, match):
+        if match.group('tag') is not None:
+            return ''
+        if match.group('numeric') is not None:
+            # html.unescape applies the HTML5 rules for invalid and remapped code points
+            return html.unescape(match.group(0))
+        return _HTML_NAMED_ENTITIES.get(match.group('named'), match.group(0))
+
+    def _replace(self, match):
+        if match.group('named') is not None and match.group('named') not in _HTML_NAMED_ENTITIES:
+            return match.group(0)
+        return self.replace_with
+
+    def process(self, text):
+        substitute = self._decode if self.mode == 'decode' else self._replace
+        new_text = []
+        for word in text:
+            if '&' in word or '<' in word:
+                new_word = _HTML_PATTERN.sub(substitute, word)
+                if self.drop_empty and not new_word and word:
+                    continue
+                word = new_word
+            new_text.append(word)
+        return new_text
+
+    def explain(self):
+        return f"Decode or replace HTML tags and entities in a sentence | Mode: {self.mode} | Replace with: {self.replace_with}"
+
 class RemoveUnicode:
     """
     A class to remove unicode characters from a words in a sentence. 
@@ -578,12 +877,20 @@ class RemoveUnicode:
     >>> remover.process(['this', 'is', 'a', 'test', '👍'])
     ['this', 'is', 'a', 'test']
     """
+    commutes = False
+
     def __init__(self, unicode_below=None, unicode_above=None, remove_unicode=[]):
         self.unicode_below = unicode_below
         self.unicode_above = unicode_above
         self.remove_unicode = remove_unicode
         if unicode_below is None and unicode_above is None and len(remove_unicode) == 0:
             raise ValueError("At least one of unicode_below or unicode_above or remove_unicode must be defined.")
+        # Pure ASCII text is only affected when one of the bounds or removed characters falls in the ASCII range
+        if (unicode_below is None or unicode_below <= 0) and (unicode_above is None or unicode_above >= 127) \
+                and all(not char.isascii() for char in remove_unicode):
+            self.triggers = frozenset([HAS_NON_ASCII])
+        else:
+            self.triggers = None
 
     def process(self, text):
         new_text = []
@@ -612,6 +919,9 @@ class RemoveWhiteSpaceOrChunksOfWhiteSpace:
     >>> remover.process(['this', 'is', 'a', ' ', 'test', '     '])
     ['this', 'is', 'a', 'test']
     """
+    triggers = None
+    commutes = True
+
     def __init__(self):
         pass
 
@@ -624,4 +934,227 @@ class RemoveWhiteSpaceOrChunksOfWhiteSpace:
         return new_text
     
     def explain(self):
-        return "Remove whitespace from a sentence or chunks of whitespace"
\ No newline at end of file
+        return "Remove whitespace from a sentence or chunks of whitespace"
+
+_KEYWORD_AUTOMATON_VERSION = 2
+
+class _KeywordAutomaton:
+    """
+    An Aho-Corasick automaton over sequences of symbols, either the words of a list or the characters of a word.
+
+    Matching takes time linear in the length of the input, whatever the number of keywords.
+    """
+    def __init__(self, keywords):
+        """Build the automaton from keywords given as tuples of symbols."""
+        goto = [{}]
+        # The length of the keyword that ends exactly in each state, 0 if none does
+        lengths = [0]
+        for keyword in keywords:
+            state = 0
+            for symbol in keyword:
+                next_state = goto[state].get(symbol)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][symbol] = next_state
+                    goto.append({})
+                    lengths.append(0)
+                state = next_state
+            lengths[state] = len(keyword)
+
+        fail = [0] * len(goto)
+        # The nearest state on the failure chain where a shorter keyword ends, 0 if there is none
+        output = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for symbol, next_state in goto[state].items():
+                queue.append(next_state)
+                fallback = fail[state]
+                while fallback and symbol not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail[next_state] = goto[fallback].get(symbol, 0)
+                output[next_state] = fail[next_state] if lengths[fail[next_state]] else output[fail[next_state]]
+        self.goto = goto
+        self.fail = fail
+        self.lengths = lengths
+        self.output = output
+
+    def find(self, sequence):
+        """Return the leftmost-longest non-overlapping matches in a sequence as (start, end) pairs."""
+        goto = self.goto
+        fail = self.fail
+        lengths = self.lengths
+        output = self.output
+        # The end of the longest keyword starting at each position, 0 if no keyword starts there
+        best_end = [0] * len(sequence)
+        state = 0
+        for index, symbol in enumerate(sequence):
+            while state and symbol not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(symbol, 0)
+            # Every keyword that ends here is recorded, ends only grow so the last one seen per start is the longest
+            match_state = state if lengths[state] else output[state]
+            while match_state:
+                best_end[index + 1 - lengths[match_state]] = index + 1
+                match_state = output[match_state]
+        matches = []
+        index = 0
+        while index < len(sequence):
+            if best_end[index]:
+                matches.append((index, best_end[index]))
+                index = best_end[index]
+            else:
+                index += 1
+        return matches
+
+
+def _lower_same_length(word):
+    """Lowercase a word, unless that changes its length and would shift the positions of the matches."""
+    lowered = word.lower()
+    return lowered if len(lowered) == len(word) else word
+
+
+def _load_keyword_automaton(keywords, ignore_case, whole_token, cache_path):
+    """Build the automaton of a keyword step, or load it from cache_path if it was built with the same arguments."""
+    if ignore_case:
+        keywords = [keyword.lower() for keyword in keywords]
+    if whole_token:
+        sequences = sorted(set(tuple(keyword.split()) for keyword in keywords) - {()})
+    else:
+        if any(len(keyword.split()) > 1 for keyword in keywords):
+            raise ValueError("Keywords made of several words can only be matched with whole_token=True.")
+        sequences = sorted(set(keywords) - {''})
+    # The format version invalidates caches written by older versions of the automaton
+    key = hashlib.sha256(repr((_KEYWORD_AUTOMATON_VERSION, sequences, ignore_case, whole_token)).encode('utf-8')).hexdigest()
+
+    if cache_path is not None and os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            cached = pickle.load(f)
+        if cached["key"] == key:
+            return cached["automaton"], key
+
+    automaton = _KeywordAutomaton(sequences)
+    if cache_path is not None:
+        tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({"key": key, "automaton": automaton}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    return automaton, key
+
+
+def _splice_keywords(automaton, text, ignore_case, whole_token, mask=None):
+    """
+    Replace the keywords found by an automaton with a mask, or remove them if mask is None.
+
+    With whole_token, a matched run of words is replaced by a single mask. Otherwise the matching characters
+    inside every word are, and words left empty by removals are dropped.
+    """
+    if whole_token:
+        matches = automaton.find([word.lower() for word in text] if ignore_case else text)
+        new_text = []
+        position = 0
+        for start, end in matches:
+            new_text.extend(text[position:start])
+            if mask is not None:
+                new_text.append(mask)
+            position = end
+        new_text.extend(text[position:])
+        return new_text
+
+    new_text = []
+    for word in text:
+        matches = automaton.find(_lower_same_length(word) if ignore_case else word)
+        if matches:
+            pieces = []
+            position = 0
+            for start, end in matches:
+                pieces.append(word[position:start])
+                if mask is not None:
+                    pieces.append(mask)
+                position = end
+            pieces.append(word[position:])
+            word = ''.join(pieces)
+            if mask is None and not word:
+                continue
+        new_text.append(word)
+    return new_text
+
+
+class MaskKeywords:
+    """
+    A class to mask keywords and keyword phrases in a list of words, using an Aho-Corasick automaton.
+
+    The automaton is built once, so matching stays linear in the length of the input even with tens of thousands of keywords.
+
+    Expected input: list of words
+    Expected output: list of words
+
+    Args:
+        keywords (list): The keywords to mask. A keyword with spaces is a phrase that matches consecutive words.
+        mask (str): The word that replaces every match. Default is '<MASK>'.
+        ignore_case (bool): If set to True, ignore the case of the words when matching them. Default is True.
+        whole_token (bool): If set to True, keywords only match complete words, and a matched phrase is replaced
+            by a single mask. If set to False, keywords also match inside words and only the matching characters are masked.
+            Default is True.
+        cache_path (str): A file to load the built automaton from, or to save it to if it is missing or was built
+            from other keywords. Only use trusted files, as they are unpickled. Default is None.
+
+    Example:
+    >>> masker = MaskKeywords(['new york', 'darn'])
+    >>> masker.process(['Darn', 'it', 'I', 'love', 'New', 'York'])
+    ['<MASK>', 'it', 'I', 'love', '<MASK>']
+    """
+    triggers = None
+    commutes = False
+
+    def __init__(self, keywords, mask="<MASK>", ignore_case=True, whole_token=True, cache_path=None):
+        self.mask = mask
+        self.ignore_case = ignore_case
+        self.whole_token = whole_token
+        self.keyword_count = len(keywords)
+        self._automaton, self.keywords_key = _load_keyword_automaton(keywords, ignore_case, whole_token, cache_path)
+
+    def process(self, text):
+        return _splice_keywords(self._automaton, text, self.ignore_case, self.whole_token, mask=self.mask)
+
+    def explain(self):
+        return f"Mask keywords in a sentence | Keywords: {self.keyword_count} | Mask: {self.mask} | Ignore case: {self.ignore_case} | Whole token: {self.whole_token}"
+
+
+class RemoveKeywords:
+    """
+    A class to remove keywords and keyword phrases from a list of words.
+
+    Keywords are matched like in `MaskKeywords`, but the matches are dropped instead of being masked.
+
+    Expected input: list of words
+    Expected output: list of words
+
+    Args:
+        keywords (list): The keywords to remove. A keyword with spaces is a phrase that matches consecutive words.
+        ignore_case (bool): If set to True, ignore the case of the words when matching them. Default is True.
+        whole_token (bool): If set to True, keywords only match complete words, which are removed. If set to False,
+            keywords also match inside words, the matching characters are removed and words left empty are dropped.
+            Default is True.
+        cache_path (str): A file to load the built automaton from, or to save it to if it is missing or was built
+            from other keywords. Only use trusted files, as they are unpickled. Default is None.
+
+    Example:
+    >>> remover = RemoveKeywords(['new york', 'darn'])
+    >>> remover.process(['Darn', 'it', 'I', 'love', 'New', 'York'])
+    ['it', 'I', 'love']
+    """
+    triggers = None
+    commutes = False
+
+    def __init__(self, keywords, ignore_case=True, whole_token=True, cache_path=None):
+        self.ignore_case = ignore_case
+        self.whole_token = whole_token
+        self.keyword_count = len(keywords)
+        self._automaton, self.keywords_key = _load_keyword_automaton(keywords, ignore_case, whole_token, cache_path)
+
+    def process(self, text):
+        return _splice_keywords(self._automaton, text, self.ignore_case, self.whole_token)
+
+    def explain(self):
+        return f"Remove keywords from a sentence | Keywords: {self.keyword_count} | Ignore case: {self.ignore_case} | Whole token: {self.whole_token}"
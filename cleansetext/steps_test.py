@@ -1,3 +1,7 @@
+import re
+
+import pytest
+
 from cleansetext.steps import *
 
 def test_stopwords_removed():
@@ -280,4 +284,130 @@ def test_process_RemoveWhiteSpaceOrChunksOfWhiteSpace():
 
 def test_explain_RemoveWhiteSpaceOrChunksOfWhiteSpace():
     remover = RemoveWhiteSpaceOrChunksOfWhiteSpace()
-    assert remover.explain() == "Remove whitespace from a sentence or chunks of whitespace"
\ No newline at end of file
+    assert remover.explain() == "Remove whitespace from a sentence or chunks of whitespace"
+
+## scan_features
+
+def test_scan_features():
+    assert scan_features(['this', 'is', 'a', 'test']) == frozenset()
+    assert scan_features(['@user', 'google.com', '&amp;']) == frozenset([HAS_AT, HAS_DOT, HAS_AMPERSAND, HAS_PUNCTUATION])
+    assert scan_features(['this', '🤔']) == frozenset([HAS_NON_ASCII])
+    assert scan_features(['this', '']) == frozenset([HAS_EMPTY_TOKEN])
+
+def test_triggers_RemoveUnicode():
+    assert RemoveUnicode(unicode_above=300).triggers == frozenset([HAS_NON_ASCII])
+    assert RemoveUnicode(unicode_below=10).triggers is None
+    assert RemoveUnicode(remove_unicode=['a']).triggers is None
+
+def test_triggers_custom_punctuations():
+    assert RemoveAllPunctuations().triggers == frozenset([HAS_PUNCTUATION, HAS_EMPTY_TOKEN])
+    assert RemoveAllPunctuations(punctuations='ab').triggers is None
+
+## ReplacePatterns
+
+def test_process_ReplacePatterns_matches_separate_steps():
+    replacer = ReplacePatterns()
+    urls = ReplaceURLsandHTMLTags()
+    usernames = ReplaceUsernames()
+    text = ['this', 'is', 'a', 'test', 'google.com', 'https://www.google.com', '&lt;', '&amp;', '&quot;',
+            '@user', '@UsErNaMe123', 'user@domain.com', 'but.you', 'fish&amp;chips', 'see:@bob', '3.14', 'lol.com']
+    assert replacer.process(text) == usernames.process(urls.process(text))
+
+def test_process_ReplacePatterns_custom_patterns():
+    replacer = ReplacePatterns(patterns={'EMAIL': r'[\w.+-]+@[\w-]+\.[\w.]+', 'HASHTAG': r'#\w+'}, replace_with={'URL': '<LINK>'})
+    text = ['mail', 'me@example.com', 'or', '@user', 'at', 'google.com', '#tbt']
+    assert replacer.process(text) == ['mail', '<EMAIL>', 'or', '<USER>', 'at', '<LINK>', '<HASHTAG>']
+    assert replacer.triggers is None
+
+def test_process_ReplacePatterns_custom_patterns_come_first():
+    replacer = ReplacePatterns(patterns={'EMAIL': r'[\w.+-]+@[\w-]+\.[\w.]+'})
+    assert replacer.process(['bob.smith@gmail.com', 'gmail.com', '@bob']) == ['<EMAIL>', '<URL>', '<USER>']
+
+def test_process_ReplacePatterns_custom_pattern_flags_and_groups():
+    replacer = ReplacePatterns(patterns={'FOO': re.compile('foo', re.I), 'BAR': '(?i)bar', 'DOUBLE': r'(?P<char>[a-z])(?P=char)'},
+                               replace_urls=False, replace_usernames=False)
+    assert replacer.process(['FOO', 'Bar', 'aab', 'Foobar']) == ['<FOO>', '<BAR>', '<DOUBLE>b', '<FOO><BAR>']
+    with pytest.raises(ValueError):
+        ReplacePatterns(patterns={'DOUBLE': r'(\w)\1'})
+    with pytest.raises(ValueError):
+        ReplacePatterns(patterns={'A': r'(?P<x>a)', 'B': r'(?P<x>b)'})
+
+def test_process_ReplacePatterns_only_replaces_matched_occurrences():
+    assert ReplacePatterns().process(['@bob@bob']) == ['<USER>@bob']
+    assert ReplaceUsernames().process(['@bob@bob']) == ['<USER><USER>']
+
+def test_ReplacePatterns_configuration():
+    assert ReplacePatterns(replace_urls=False).process(['google.com', '@user']) == ['google.com', '<USER>']
+    assert ReplacePatterns(replace_usernames=False).triggers == frozenset([HAS_DOT, HAS_AMPERSAND])
+    with pytest.raises(ValueError):
+        ReplacePatterns(patterns={'URL': r'x'})
+    with pytest.raises(ValueError):
+        ReplacePatterns(replace_urls=False, replace_usernames=False)
+
+def test_explain_ReplacePatterns():
+    replacer = ReplacePatterns(replace_urls=False)
+    assert replacer.explain() == "Replace patterns in a sentence | Replace with: {'USER': '<USER>'}"
+
+## MaskKeywords and RemoveKeywords
+
+def test_process_MaskKeywords():
+    masker = MaskKeywords(['new york', 'darn', 'new york city', 'york'])
+    assert masker.process(['Darn', 'it', 'I', 'love', 'New', 'York', 'City', 'and', 'york']) == ['<MASK>', 'it', 'I', 'love', '<MASK>', 'and', '<MASK>']
+    assert masker.process(['new', 'new', 'york']) == ['new', '<MASK>']
+    assert masker.process([]) == []
+
+def test_case_sensitive_MaskKeywords():
+    masker = MaskKeywords(['Darn'], mask='***', ignore_case=False)
+    assert masker.process(['Darn', 'darn']) == ['***', 'darn']
+
+def test_partial_words_MaskKeywords():
+    masker = MaskKeywords(['darn', 'he'], mask='*', whole_token=False)
+    assert masker.process(['DARNED', 'she', 'sheds', 'it']) == ['*ED', 's*', 's*ds', 'it']
+    with pytest.raises(ValueError):
+        MaskKeywords(['new york'], whole_token=False)
+
+def test_process_RemoveKeywords():
+    remover = RemoveKeywords(['new york', 'darn'])
+    assert remover.process(['Darn', 'it', 'I', 'love', 'New', 'York']) == ['it', 'I', 'love']
+    remover = RemoveKeywords(['darn'], whole_token=False)
+    assert remover.process(['darn', 'darned', 'it']) == ['ed', 'it']
+
+def test_cache_path_MaskKeywords(tmp_path):
+    cache_path = str(tmp_path / "keywords.pkl")
+    masker = MaskKeywords(['darn'], cache_path=cache_path)
+    cached = MaskKeywords(['darn'], cache_path=cache_path)
+    assert cached.keywords_key == masker.keywords_key
+    assert cached.process(['darn', 'it']) == ['<MASK>', 'it']
+    rebuilt = MaskKeywords(['heck'], cache_path=cache_path)
+    assert rebuilt.process(['darn', 'heck']) == ['darn', '<MASK>']
+
+def test_explain_MaskKeywords():
+    masker = MaskKeywords(['darn', 'heck'])
+    assert masker.explain() == "Mask keywords in a sentence | Keywords: 2 | Mask: <MASK> | Ignore case: True | Whole token: True"
+
+## UnescapeOrStripHTML
+
+def test_decode_UnescapeOrStripHTML():
+    decoder = UnescapeOrStripHTML()
+    text = ['fish', '&amp;', 'chips', '<br/>', 'it&#39;s', 'caf&eacute;', '&#x1F600;', '&bogus;', 'a&nbsp;b', '<b>bold</b>', 'x<y']
+    assert decoder.process(text) == ['fish', '&', 'chips', "it's", 'café', '😀', '&bogus;', 'a\xa0b', 'bold', 'x<y']
+    assert UnescapeOrStripHTML(drop_empty=False).process(['<br/>', 'hi']) == ['', 'hi']
+
+def test_replace_UnescapeOrStripHTML():
+    replacer = UnescapeOrStripHTML(mode='replace', replace_with='<H>')
+    assert replacer.process(['&amp;', '<br/>', 'a&bogus;', 'x<i>y', '&#39;', 'plain']) == ['<H>', '<H>', 'a&bogus;', 'x<H>y', '<H>', 'plain']
+    with pytest.raises(ValueError):
+        UnescapeOrStripHTML(mode='strip')
+
+def test_triggers_UnescapeOrStripHTML():
+    assert scan_features(['<br/>']) == frozenset([HAS_LESS_THAN, HAS_PUNCTUATION])
+    assert UnescapeOrStripHTML().triggers.isdisjoint(scan_features(['plain', 'text.']))
+
+def test_explain_UnescapeOrStripHTML():
+    assert UnescapeOrStripHTML().explain() == "Decode or replace HTML tags and entities in a sentence | Mode: decode | Replace with: <HTML>"
+
+def test_overlapping_keywords_sharing_an_end_MaskKeywords():
+    assert MaskKeywords(['a b', 'b c d', 'd']).process(['a', 'b', 'c', 'd']) == ['<MASK>', 'c', '<MASK>']
+    assert MaskKeywords(['ab', 'bcd', 'd'], mask='*', whole_token=False).process(['abcd']) == ['*c*']
+    assert RemoveKeywords(['a b', 'b c d', 'd']).process(['a', 'b', 'c', 'd', 'e']) == ['c', 'e']
+    assert MaskKeywords(['x y z', 'y', 'z']).process(['x', 'y', 'w', 'z']) == ['x', '<MASK>', 'w', '<MASK>']
@@ -0,0 +1,274 @@
+"""
+Line and JSONL readers and writers for plain, gzip, bz2 and xz files.
+
+Decompression and compression run on background threads with bounded queues, so that codec and disk time
+overlaps with the cleaning done in the calling thread. The codecs of the standard library release the GIL
+while they work on large blocks, which is why data moves between the threads in large blocks, not line by line.
+"""
+import bz2
+import gzip
+import json
+import lzma
+import queue
+import threading
+
+_END = object()
+
+def open_compressed(path, mode='rb', compresslevel=None):
+    """
+    Open a file in binary mode, compressed or not depending on its extension.
+
+    Args:
+        path (str): The path of the file. Files ending with .gz, .bz2, .xz or .lzma are compressed with the matching codec.
+        mode (str): 'rb', 'wb' or 'ab'. Default is 'rb'.
+        compresslevel (int): The compression level when writing, from 1 (fastest) to 9 (smallest) for gzip and bz2,
+            and the preset from 0 to 9 for xz. Ignored when reading. Default is the codec default, 9 for gzip and bz2
+            and 6 for xz.
+
+    Returns:
+        file: A binary file object.
+    """
+    path_str = str(path)
+    writing = not mode.startswith('r')
+    if path_str.endswith('.gz'):
+        if writing and compresslevel is not None:
+            return gzip.open(path, mode, compresslevel=compresslevel)
+        return gzip.open(path, mode)
+    if path_str.endswith('.bz2'):
+        if writing and compresslevel is not None:
+            return bz2.open(path, mode, compresslevel=compresslevel)
+        return bz2.open(path, mode)
+    if path_str.endswith(('.xz', '.lzma')):
+        if writing and compresslevel is not None:
+            return lzma.open(path, mode, preset=compresslevel)
+        return lzma.open(path, mode)
+    return open(path, mode)
+
+
+class ThreadedLineReader:
+    """
+    A class to read the lines of a possibly compressed file, decompressing ahead on a background thread.
+
+    Args:
+        path (str): The path of the file.
+        prefetch (int): The number of blocks of lines decoded ahead of the reader. Default is 8.
+        block_size (int): The number of bytes read from the file at a time. Default is 1 MiB.
+        encoding (str): The encoding of the file. Default is 'utf-8'.
+
+    Example:
+        with ThreadedLineReader('tweets.txt.gz') as reader:
+            for line in reader:
+                pipeline.process(tk.tokenize(line))
+    """
+    def __init__(self, path, prefetch=8, block_size=1 << 20, encoding='utf-8'):
+        """Initialize the ThreadedLineReader instance and start reading in the background."""
+        self.path = path
+        self.block_size = block_size
+        self.encoding = encoding
+        self._queue = queue.Queue(maxsize=prefetch)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._read, name="cleansetext-reader", daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        """Put an item on the queue, giving up if the reader was closed."""
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _decode(self, line):
+        """Decode a line, dropping the carriage return of Windows line endings."""
+        if line.endswith(b'\r'):
+            line = line[:-1]
+        return line.decode(self.encoding)
+
+    def _read(self):
+        try:
+            with open_compressed(self.path, 'rb') as f:
+                remainder = b''
+                while not self._stop.is_set():
+                    block = f.read(self.block_size)
+                    if not block:
+                        break
+                    lines = (remainder + block).split(b'\n')
+                    remainder = lines.pop()
+                    if lines and not self._put([self._decode(line) for line in lines]):
+                        return
+                if remainder:
+                    self._put([self._decode(remainder)])
+            self._put(_END)
+        except BaseException as e:
+            self._put(e)
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is _END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield from item
+
+    def close(self):
+        """Stop reading in the background."""
+        self._stop.set()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ThreadedLineWriter:
+    """
+    A class to write lines to a possibly compressed file, compressing and writing behind on a background thread.
+
+    Args:
+        path (str): The path of the file. It is compressed if its extension is .gz, .bz2, .xz or .lzma.
+        queue_size (int): The number of blocks waiting to be written before `write` blocks. Default is 8.
+        block_size (int): The number of bytes gathered before a block is handed to the background thread. Default is 1 MiB.
+        encoding (str): The encoding of the file. Default is 'utf-8'.
+        append (bool): If set to True, append to the file instead of overwriting it. Default is False.
+        compresslevel (int): The compression level, or the preset for xz, see `open_compressed`. Lower levels
+            compress faster. Default is the codec default.
+
+    Example:
+        with ThreadedLineWriter('clean.txt.gz', compresslevel=1) as writer:
+            writer.write(' '.join(tokens))
+    """
+    def __init__(self, path, queue_size=8, block_size=1 << 20, encoding='utf-8', append=False, compresslevel=None):
+        """Initialize the ThreadedLineWriter instance, open the file and start writing on a background thread."""
+        self.path = path
+        self.block_size = block_size
+        self.encoding = encoding
+        self._buffer = []
+        self._buffered_bytes = 0
+        self._error = None
+        self._closed = False
+        self._queue = queue.Queue(maxsize=queue_size)
+        # The file is opened here, so that errors opening it are raised to the caller
+        self._file = open_compressed(path, 'ab' if append else 'wb', compresslevel=compresslevel)
+        self._thread = threading.Thread(target=self._write, name="cleansetext-writer", daemon=True)
+        self._thread.start()
+
+    def _write(self):
+        try:
+            while True:
+                block = self._queue.get()
+                if block is _END:
+                    break
+                self._file.write(block)
+        except BaseException as e:
+            self._error = e
+            # Keep draining so that the writing thread never blocks on a full queue
+            while self._queue.get() is not _END:
+                pass
+        finally:
+            self._file.close()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def write(self, line):
+        """
+        Write one line. A newline is added after it.
+
+        Args:
+            line (str): The line to write, without a trailing newline.
+        """
+        self._raise_error()
+        data = (line + "\n").encode(self.encoding)
+        self._buffer.append(data)
+        self._buffered_bytes += len(data)
+        if self._buffered_bytes >= self.block_size:
+            self.flush()
+
+    def write_many(self, lines):
+        """
+        Write several lines.
+
+        Args:
+            lines (iterable): The lines to write, without trailing newlines.
+        """
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        """Hand the buffered lines to the background thread."""
+        if self._buffer:
+            self._queue.put(b''.join(self._buffer))
+            self._buffer = []
+            self._buffered_bytes = 0
+
+    def close(self):
+        """Write the remaining lines, wait for the background thread and close the file."""
+        if self._closed:
+            return
+        self._closed = True
+        self.flush()
+        self._queue.put(_END)
+        self._thread.join()
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ThreadedJSONLWriter(ThreadedLineWriter):
+    """
+    A class to write JSON values, one per line, to a possibly compressed file on a background thread.
+
+    Takes the same arguments as `ThreadedLineWriter`.
+
+    Example:
+        with ThreadedJSONLWriter('clean.jsonl.xz') as writer:
+            writer.write_many(pipeline.process_batch(texts))
+    """
+    def write(self, value):
+        """
+        Write one JSON value.
+
+        Args:
+            value: A JSON serializable value, e.g. a list of words.
+        """
+        super().write(json.dumps(value, ensure_ascii=False))
+
+
+def read_lines(path, prefetch=8, block_size=1 << 20, encoding='utf-8'):
+    """
+    Iterate over the lines of a possibly compressed file, decompressing ahead on a background thread.
+
+    Args:
+        path (str): The path of the file.
+        prefetch (int): The number of blocks of lines decoded ahead of the reader. Default is 8.
+        block_size (int): The number of bytes read from the file at a time. Default is 1 MiB.
+        encoding (str): The encoding of the file. Default is 'utf-8'.
+
+    Yields:
+        str: Every line, without its trailing newline.
+    """
+    with ThreadedLineReader(path, prefetch=prefetch, block_size=block_size, encoding=encoding) as reader:
+        yield from reader
+
+def read_jsonl(path, prefetch=8, block_size=1 << 20, encoding='utf-8'):
+    """
+    Iterate over the JSON values of a possibly compressed JSONL file, decompressing ahead on a background thread.
+
+    Takes the same arguments as `read_lines`. Blank lines are skipped.
+
+    Yields:
+        The JSON value of every line.
+    """
+    for line in read_lines(path, prefetch=prefetch, block_size=block_size, encoding=encoding):
+        if line.strip():
+            yield json.loads(line)
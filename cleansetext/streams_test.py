@@ -0,0 +1,63 @@
+import gzip
+
+import pytest
+
+from cleansetext.pipeline import Pipeline
+from cleansetext.steps import *
+from cleansetext.streams import ThreadedJSONLWriter, ThreadedLineReader, ThreadedLineWriter, read_jsonl, read_lines
+
+@pytest.mark.parametrize("extension", ["txt", "txt.gz", "txt.bz2", "txt.xz"])
+def test_lines_round_trip(tmp_path, extension):
+    path = str(tmp_path / f"corpus.{extension}")
+    lines = [f"line {i} with émoji 🎉" for i in range(1000)] + ["", "last"]
+    with ThreadedLineWriter(path, queue_size=2, block_size=100) as writer:
+        writer.write_many(lines)
+
+    assert list(read_lines(path, prefetch=2, block_size=64)) == lines
+
+def test_reader_strips_windows_line_endings(tmp_path):
+    path = tmp_path / "corpus.txt"
+    path.write_bytes(b"first\r\nsecond\r\n\r\nlast\r")
+    assert list(read_lines(str(path), block_size=3)) == ["first", "second", "", "last"]
+
+@pytest.mark.parametrize("extension", ["txt", "txt.gz", "txt.bz2", "txt.xz"])
+def test_writer_compresslevel(tmp_path, extension):
+    path = str(tmp_path / f"corpus.{extension}")
+    lines = [f"line {i}" for i in range(100)]
+    with ThreadedLineWriter(path, compresslevel=1) as writer:
+        writer.write_many(lines)
+    assert list(read_lines(path)) == lines
+    if extension == "txt.gz":
+        # The extra flags byte of the gzip header records that the fastest level was used
+        with open(path, 'rb') as f:
+            assert f.read(9)[8] == 4
+
+def test_writer_append(tmp_path):
+    path = str(tmp_path / "corpus.txt.gz")
+    with ThreadedLineWriter(path) as writer:
+        writer.write("first")
+    with ThreadedLineWriter(path, append=True) as writer:
+        writer.write("second")
+    assert gzip.open(path).read() == b"first\nsecond\n"
+
+def test_jsonl_round_trip_with_pipeline(tmp_path):
+    source = str(tmp_path / "raw.jsonl.gz")
+    output = str(tmp_path / "clean.jsonl.xz")
+    with ThreadedJSONLWriter(source) as writer:
+        writer.write_many(["@user hi 🎉", "plain text"])
+
+    pipeline = Pipeline([RemoveEmojis(), ReplaceUsernames()])
+    with ThreadedJSONLWriter(output) as writer:
+        writer.write_many(pipeline.process_batch(text.split() for text in read_jsonl(source)))
+
+    assert list(read_jsonl(output)) == [['<USER>', 'hi'], ['plain', 'text']]
+
+def test_reader_errors_and_early_close(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        list(read_lines(str(tmp_path / "missing.txt.gz")))
+
+    path = str(tmp_path / "corpus.txt")
+    with ThreadedLineWriter(path) as writer:
+        writer.write_many(str(i) for i in range(10000))
+    with ThreadedLineReader(path, prefetch=1, block_size=16) as reader:
+        assert next(iter(reader)) == "0"
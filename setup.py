@@ -17,6 +17,10 @@ setup(
     author_email="aflahkhan.2020@gmail.com",
     license="MIT",
     install_requires=["nltk", "emoji"],
+    extras_require={
+        "pandas": ["pandas"],
+        "arrow": ["pyarrow"],
+    },
     packages=find_packages(),
     python_requires=">=3.7",
     classifiers=[